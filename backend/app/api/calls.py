@@ -1,44 +1,115 @@
 
-from fastapi import APIRouter, HTTPException, Depends
-from app.models.schemas import CallSimulation
-from app.core.database import get_db
-import asyncio
+from fastapi import APIRouter, HTTPException, Depends, File, Form, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from app.models.schemas import CallSimulation, CampaignCreate
+from app.core.unit_of_work import UnitOfWork, get_uow
+from app.core.stats_aggregator import stats_aggregator
+from app.core.session_cache import session_cache
+from app.core.campaigns import campaign_manager, place_call
+from app.core.logging_config import get_logger
+from typing import List, Optional, Tuple
+import csv
+import io
+import json
+import re
 
 router = APIRouter()
 
+logger = get_logger(__name__)
+
+PHONE_PATTERN = re.compile(r"^\+?[0-9][0-9 ()\-.]{5,19}$")
+
+# Encabezados reconocidos para la columna de teléfono en el CSV
+PHONE_HEADERS = ("phone_number", "phone", "telefono", "teléfono", "numero", "número")
+
+def _clean_phone_numbers(raw_numbers: List[Tuple[int, str]]) -> Tuple[List[str], List[dict]]:
+    """Valida y deduplica (conservando el orden); devuelve (válidos, rechazados con motivo)"""
+    valid, rejected, seen = [], [], set()
+    for row, raw in raw_numbers:
+        number = (raw or "").strip()
+        if not PHONE_PATTERN.match(number) or len(number) > 20:
+            rejected.append({"row": row, "value": raw, "reason": "Teléfono inválido"})
+        elif number in seen:
+            rejected.append({"row": row, "value": raw, "reason": "Duplicado"})
+        else:
+            seen.add(number)
+            valid.append(number)
+    return valid, rejected
+
+def _parse_csv(content: bytes) -> List[Tuple[int, str]]:
+    """Lee la columna de teléfonos: la del encabezado reconocido o, si no hay encabezado, la primera"""
+    rows = list(csv.reader(io.StringIO(content.decode("utf-8-sig"))))
+    if not rows:
+        return []
+    
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = next((header.index(h) for h in PHONE_HEADERS if h in header), None)
+    start = 1 if column is not None else 0
+    column = column or 0
+    
+    return [
+        (index + 1, row[column] if column < len(row) else "")
+        for index, row in enumerate(rows[start:], start=start)
+        if any(cell.strip() for cell in row)
+    ]
+
+def _sse_event(event: str, data) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _start_campaign(session_id: str, raw_numbers: List[Tuple[int, str]], concurrency: Optional[int]):
+    session = await session_cache.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    
+    phone_numbers, rejected = _clean_phone_numbers(raw_numbers)
+    if not phone_numbers:
+        raise HTTPException(status_code=400, detail="No hay teléfonos válidos en la campaña")
+    if len(phone_numbers) > campaign_manager.max_calls:
+        raise HTTPException(
+            status_code=413,
+            detail=f"La campaña supera el máximo de {campaign_manager.max_calls} llamadas"
+        )
+    
+    campaign = await campaign_manager.create(session, phone_numbers, concurrency)
+    
+    return {
+        **campaign.snapshot(),
+        "rejected_count": len(rejected),
+        # Solo los primeros rechazos, para no devolver listas enormes
+        "rejected": rejected[:100]
+    }
+
+async def _fetch_campaign(uow: UnitOfWork, campaign_id: str) -> dict:
+    row = await uow.fetchrow("SELECT * FROM call_campaigns WHERE id = $1", campaign_id)
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    
+    campaign = dict(row)
+    campaign['pending_calls'] = campaign['total_calls'] - campaign['completed_calls'] - campaign['failed_calls']
+    return campaign
+
 @router.post("/simulate")
-async def simulate_call(call_data: CallSimulation, db = Depends(get_db)):
+async def simulate_call(call_data: CallSimulation):
     try:
         # Verificar que la sesión existe
-        async with await db.get_connection() as conn:
-            session = await conn.fetchrow("""
-                SELECT business_name, system_prompt FROM sessions WHERE id = $1
-            """, call_data.session_id)
-            
-            if not session:
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        session = await session_cache.get(call_data.session_id)
         
-        # Simular delay de procesamiento
-        await asyncio.sleep(2)
+        if not session:
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
         
         # Simular llamada exitosa (aquí iría la integración real con RetellAI/ElevenLabs)
-        print(f"🔊 Simulando llamada para {session['business_name']} al {call_data.phone_number}")
-        print(f"📝 Usando prompt: {session['system_prompt'][:100]}...")
+        logger.debug("Simulando llamada", session_id=call_data.session_id)
+        minutes = await place_call(session, call_data.phone_number)
         
-        # Actualizar estadísticas
-        async with await db.get_connection() as conn:
-            await conn.execute("""
-                UPDATE stats SET 
-                    total_calls = total_calls + 1,
-                    total_minutes = total_minutes + 3,
-                    last_activity = CURRENT_TIMESTAMP
-                WHERE session_id = $1
-            """, call_data.session_id)
+        # Actualizar estadísticas (volcado por lotes)
+        stats_aggregator.add(call_data.session_id, total_calls=1, total_minutes=minutes)
         
         return {
             "status": "success",
             "message": f"Llamada simulada exitosamente al {call_data.phone_number}",
-            "call_duration": "3 minutos",
+            "call_duration": f"{minutes} minutos",
             "business_name": session['business_name']
         }
         
@@ -47,38 +118,139 @@ async def simulate_call(call_data: CallSimulation, db = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error simulando llamada: {str(e)}")
 
+@router.post("/campaigns", status_code=202)
+async def create_campaign(campaign_data: CampaignCreate):
+    """Encola una campaña de llamadas a partir de una lista de teléfonos"""
+    try:
+        raw_numbers = list(enumerate(campaign_data.phone_numbers, start=1))
+        return await _start_campaign(campaign_data.session_id, raw_numbers, campaign_data.concurrency)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creando campaña: {str(e)}")
+
+@router.post("/campaigns/upload", status_code=202)
+async def upload_campaign(session_id: str = Form(...), concurrency: Optional[int] = Form(None),
+                          file: UploadFile = File(...)):
+    """Encola una campaña desde un CSV (columna phone_number/telefono, o la primera columna)"""
+    try:
+        try:
+            raw_numbers = _parse_csv(await file.read())
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=f"CSV inválido: {str(e)}")
+        
+        return await _start_campaign(session_id, raw_numbers, concurrency)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creando campaña: {str(e)}")
+
+@router.get("/campaigns/{campaign_id}")
+async def get_campaign(campaign_id: str, uow: UnitOfWork = Depends(get_uow)):
+    """Estado y contadores de una campaña"""
+    campaign = campaign_manager.get(campaign_id)
+    if campaign is not None:
+        return campaign.snapshot()
+    
+    try:
+        return await _fetch_campaign(uow, campaign_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo campaña: {str(e)}")
+
+@router.post("/campaigns/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: str):
+    """Deja de marcar números nuevos; las llamadas en curso terminan normalmente"""
+    if not campaign_manager.cancel(campaign_id):
+        raise HTTPException(status_code=404, detail="Campaña no encontrada o ya finalizada")
+    return {"message": "Cancelación solicitada", "campaign_id": campaign_id}
+
+@router.get("/campaigns/{campaign_id}/events")
+async def stream_campaign_events(campaign_id: str, uow: UnitOfWork = Depends(get_uow)):
+    """Progreso de la campaña como Server-Sent Events (`progress` periódicos y un `done` final)"""
+    campaign = campaign_manager.get(campaign_id)
+    
+    if campaign is None:
+        # Ya terminó (o corre en otra réplica): se envía el estado guardado
+        finished = await _fetch_campaign(uow, campaign_id)
+        
+        async def finished_stream():
+            yield _sse_event("done", finished)
+        
+        return StreamingResponse(finished_stream(), media_type="text/event-stream")
+    
+    queue = campaign_manager.subscribe(campaign)
+    
+    async def event_stream():
+        try:
+            yield _sse_event("progress", campaign.snapshot())
+            while True:
+                event, data = await queue.get()
+                yield _sse_event(event, data)
+                if event == "done":
+                    break
+        finally:
+            campaign_manager.unsubscribe(campaign, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/campaigns/{campaign_id}/calls")
+async def get_campaign_calls(campaign_id: str, after_id: int = Query(0, ge=0),
+                             limit: int = Query(100, ge=1, le=1000), uow: UnitOfWork = Depends(get_uow)):
+    """Resultado de cada llamada, paginado por id (`after_id` = último id recibido)"""
+    try:
+        rows = await uow.fetch("""
+            SELECT id, phone_number, status, duration_minutes, error, started_at, finished_at
+            FROM campaign_calls
+            WHERE campaign_id = $1 AND id > $2
+            ORDER BY id
+            LIMIT $3
+        """, campaign_id, after_id, limit)
+        
+        calls = [dict(row) for row in rows]
+        return {
+            "campaign_id": campaign_id,
+            "calls": calls,
+            "next_after_id": calls[-1]['id'] if len(calls) == limit else None
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo llamadas de la campaña: {str(e)}")
+
 @router.get("/retell-config/{session_id}")
-async def get_retell_config(session_id: str, db = Depends(get_db)):
+async def get_retell_config(session_id: str):
     """Obtener configuración para integración con RetellAI"""
     try:
-        async with await db.get_connection() as conn:
-            session = await conn.fetchrow("""
-                SELECT s.*, ac.* FROM sessions s 
-                LEFT JOIN agent_configs ac ON s.id = ac.session_id 
-                WHERE s.id = $1
-            """, session_id)
-            
-            if not session:
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
-            
-            return {
-                "session_id": session_id,
-                "system_prompt": session['system_prompt'],
-                "voice_config": {
-                    "provider": session['voice_provider'] or 'retell',
-                    "voice_id": session['voice_id'] or 'default-voice'
-                },
-                "llm_config": {
-                    "max_tokens": session['max_tokens'] or 1000,
-                    "temperature": float(session['temperature']) if session['temperature'] else 0.7
-                },
-                "business_info": {
-                    "name": session['business_name'],
-                    "phone": session['phone'],
-                    "location": session['location']
-                }
+        session = await session_cache.get(session_id)
+        
+        if not session:
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        return {
+            "session_id": session_id,
+            "system_prompt": session['system_prompt'],
+            "voice_config": {
+                "provider": session['voice_provider'] or 'retell',
+                "voice_id": session['voice_id'] or 'default-voice'
+            },
+            "llm_config": {
+                "max_tokens": session['max_tokens'] or 1000,
+                "temperature": float(session['temperature']) if session['temperature'] else 0.7
+            },
+            "business_info": {
+                "name": session['business_name'],
+                "phone": session['phone'],
+                "location": session['location']
             }
-            
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -1,85 +1,123 @@
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from app.models.schemas import ChatMessage, ChatResponse
-from app.core.database import get_db
-from app.core.langraph_agent import CallFlowAgent
+from app.core.unit_of_work import UnitOfWork, get_uow
+from app.core.agent_registry import agent_registry
+from app.core.stats_aggregator import stats_aggregator
+from app.core.session_cache import session_cache
+from app.core.response_cache import response_cache
+from app.core.context_window import update_summary, context_window_manager, CONTEXT_SUMMARY_MAX_MESSAGES
+from app.core.llm_gateway import llm_gateway, LLMUnavailableError
+from app.core.event_bus import event_bus
+from app.core.message_archive import message_archive
+from app.core.logging_config import get_logger
+from typing import Optional
+import base64
 import json
 from datetime import datetime
 
 router = APIRouter()
 
+logger = get_logger(__name__)
+
+async def _load_chat_context(uow: UnitOfWork, chat_data: ChatMessage):
+    """Carga la sesión (desde la caché), su resumen de conversación y los mensajes aún no resumidos
+    que pueden hacer falta: los que caben en la ventana y el siguiente delta del resumen"""
+    session_data = await session_cache.get(chat_data.session_id)
+    
+    if not session_data:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    
+    rows = await uow.fetch_prepared(
+        "history_fetch", chat_data.session_id,
+        context_window_manager.max_messages, CONTEXT_SUMMARY_MAX_MESSAGES
+    )
+    
+    if not rows[0]['session_active']:
+        # Eliminada desde otro worker: descartar lo que este proceso aún tenga en caché
+        await session_cache.invalidate(chat_data.session_id)
+        agent_registry.invalidate(chat_data.session_id)
+        response_cache.invalidate_session(chat_data.session_id)
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    
+    summary = rows[0]['summary'] or ''
+    summarized_until_id = rows[0]['summarized_until_id']
+    
+    # Convertir historial a formato esperado (orden cronológico)
+    history = [
+        {
+            "id": msg['id'],
+            "content": msg['content'],
+            "sender": msg['sender'],
+            "timestamp": msg['timestamp'].isoformat()
+        }
+        for msg in reversed(rows)
+        if msg['id'] is not None
+    ]
+    
+    return session_data, history, summary, summarized_until_id
+
+def _schedule_summary_update(background_tasks: BackgroundTasks, uow: UnitOfWork, agent, session_id: str,
+                             summary: str, summarized_until_id: int, result: dict):
+    """Resume fuera del camino crítico los mensajes que ya no caben en la ventana de contexto"""
+    if result.get('summary_delta'):
+        background_tasks.add_task(
+            update_summary, uow, agent.llm, session_id, summary, summarized_until_id, result['summary_delta']
+        )
+
+async def _save_exchange(uow: UnitOfWork, chat_data: ChatMessage, result: dict) -> int:
+    """Guarda el mensaje del usuario y la respuesta del AI en una sola sentencia.
+    
+    Ambos mensajes se confirman (o se descartan) juntos con un solo round-trip;
+    los contadores de stats se delegan al agregador. Devuelve el id del mensaje del AI.
+    """
+    ai_message_id = await uow.fetchval_prepared(
+        "message_insert",
+        chat_data.session_id, chat_data.message, chat_data.user_type,
+        result['response'], json.dumps(result.get('metadata', {}))
+    )
+    
+    # Mensajes nuevos para los dashboards conectados
+    now = datetime.now().isoformat()
+    event_bus.publish(chat_data.session_id, "message", {
+        "sender": chat_data.user_type, "content": chat_data.message, "timestamp": now
+    })
+    event_bus.publish(chat_data.session_id, "message", {
+        "id": ai_message_id, "sender": "ai", "content": result['response'],
+        "response_type": result.get('response_type'), "timestamp": now
+    })
+    
+    # Actualizar estadísticas (mensajes / lead / cita) de forma diferida
+    response_type = result.get('response_type')
+    stats_aggregator.add(
+        chat_data.session_id,
+        messages_count=2,
+        leads=1 if response_type == 'lead_capture' else 0,
+        scheduled_visits=1 if response_type == 'appointment' else 0
+    )
+    
+    return ai_message_id
+
+def _sse_event(event: str, data) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 @router.post("/", response_model=ChatResponse)
-async def process_chat_message(chat_data: ChatMessage, db = Depends(get_db)):
+async def process_chat_message(chat_data: ChatMessage, background_tasks: BackgroundTasks,
+                               uow: UnitOfWork = Depends(get_uow)):
     try:
-        # Obtener datos de la sesión
-        async with await db.get_connection() as conn:
-            session_row = await conn.fetchrow("""
-                SELECT * FROM sessions WHERE id = $1
-            """, chat_data.session_id)
-            
-            if not session_row:
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
-            
-            # Convertir row a dict
-            session_data = dict(session_row)
-            
-            # Obtener historial de conversación reciente (últimos 10 mensajes)
-            conversation_history = await conn.fetch("""
-                SELECT content, sender, timestamp FROM messages 
-                WHERE session_id = $1 
-                ORDER BY timestamp DESC 
-                LIMIT 10
-            """, chat_data.session_id)
-            
-            # Guardar mensaje del usuario
-            user_message_id = await conn.fetchval("""
-                INSERT INTO messages (session_id, content, sender) 
-                VALUES ($1, $2, $3) 
-                RETURNING id
-            """, chat_data.session_id, chat_data.message, chat_data.user_type)
+        session_data, history, summary, summarized_until_id = await _load_chat_context(uow, chat_data)
         
-        # Procesar con LangGraph
-        agent = CallFlowAgent(session_data)
+        # Procesar con LangGraph (agente compartido desde el registro)
+        agent = agent_registry.get_agent(session_data)
         
-        # Convertir historial a formato esperado
-        history = [
-            {
-                "content": msg['content'],
-                "sender": msg['sender'],
-                "timestamp": msg['timestamp'].isoformat()
-            }
-            for msg in reversed(conversation_history)  # Orden cronológico
-        ]
+        result = await agent.process_message(chat_data.message, history, summary)
         
-        result = await agent.process_message(chat_data.message, history)
-        
-        # Guardar respuesta del AI
-        async with await db.get_connection() as conn:
-            ai_message_id = await conn.fetchval("""
-                INSERT INTO messages (session_id, content, sender, metadata) 
-                VALUES ($1, $2, $3, $4) 
-                RETURNING id
-            """, chat_data.session_id, result['response'], 'ai', 
-                json.dumps(result.get('metadata', {})))
-            
-            # Actualizar estadísticas
-            await conn.execute("""
-                UPDATE stats SET 
-                    last_activity = CURRENT_TIMESTAMP
-                WHERE session_id = $1
-            """, chat_data.session_id)
-            
-            # Si es un lead, incrementar contador
-            if result.get('response_type') == 'lead_capture':
-                await conn.execute("""
-                    UPDATE stats SET leads = leads + 1 WHERE session_id = $1
-                """, chat_data.session_id)
-            
-            # Si es una cita, incrementar contador
-            if result.get('response_type') == 'appointment':
-                await conn.execute("""
-                    UPDATE stats SET scheduled_visits = scheduled_visits + 1 WHERE session_id = $1
-                """, chat_data.session_id)
+        # Guardar mensaje del usuario, respuesta del AI y estadísticas
+        ai_message_id = await _save_exchange(uow, chat_data, result)
+        _schedule_summary_update(background_tasks, uow, agent, chat_data.session_id, summary,
+                                 summarized_until_id, result)
         
         return ChatResponse(
             id=str(ai_message_id),
@@ -89,35 +127,188 @@ async def process_chat_message(chat_data: ChatMessage, db = Depends(get_db)):
             session_id=chat_data.session_id,
             metadata=result.get('metadata', {})
         )
-        
+    
     except HTTPException:
         raise
+    except LLMUnavailableError as e:
+        logger.warning("LLM no disponible", session_id=chat_data.session_id, error=str(e))
+        raise HTTPException(status_code=503, detail="El asistente no está disponible en este momento, intenta de nuevo")
     except Exception as e:
-        print(f"Error en chat: {e}")
+        logger.error("Error en chat", session_id=chat_data.session_id, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error procesando mensaje: {str(e)}")
 
+@router.post("/stream")
+async def stream_chat_message(chat_data: ChatMessage, uow: UnitOfWork = Depends(get_uow)):
+    """Igual que POST /api/chat/ pero envía los tokens como Server-Sent Events.
+    
+    Eventos: `token` ({"content"}) por cada fragmento, `done` con el ChatResponse
+    final una vez guardado el mensaje, o `error` si algo falla a mitad del stream.
+    """
+    try:
+        session_data, history, summary, summarized_until_id = await _load_chat_context(uow, chat_data)
+        agent = agent_registry.get_agent(session_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error en chat", session_id=chat_data.session_id, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error procesando mensaje: {str(e)}")
+    
+    background_tasks = BackgroundTasks()
+    
+    async def event_stream():
+        try:
+            result = None
+            async for event in agent.stream_message(chat_data.message, history, summary):
+                if event['type'] == 'token':
+                    yield _sse_event("token", {"content": event['content']})
+                else:
+                    result = event['result']
+            
+            # Guardar el intercambio una vez terminado el stream
+            ai_message_id = await _save_exchange(uow, chat_data, result)
+            _schedule_summary_update(background_tasks, uow, agent, chat_data.session_id, summary,
+                                     summarized_until_id, result)
+            
+            response = ChatResponse(
+                id=str(ai_message_id),
+                content=result['response'],
+                sender='ai',
+                timestamp=datetime.now(),
+                session_id=chat_data.session_id,
+                metadata=result.get('metadata', {})
+            )
+            yield _sse_event("done", response.model_dump(mode="json"))
+        
+        except Exception as e:
+            logger.error("Error en chat stream", session_id=chat_data.session_id, exc_info=True)
+            yield _sse_event("error", {"detail": f"Error procesando mensaje: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Evita que nginx acumule la respuesta antes de enviarla
+            "X-Accel-Buffering": "no"
+        },
+        background=background_tasks
+    )
+
+def _encode_cursor(timestamp: datetime, message_id: int) -> str:
+    """Cursor opaco con la clave de orden (timestamp, id) de un mensaje"""
+    raw = f"{timestamp.isoformat()}|{message_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @router.get("/{session_id}/history")
-async def get_chat_history(session_id: str, limit: int = 50, db = Depends(get_db)):
+async def get_chat_history(
+    session_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    uow: UnitOfWork = Depends(get_uow)
+):
+    """Historial en orden cronológico con paginación por keyset.
+    
+    Sin cursor devuelve los primeros `limit` mensajes. `after` pagina hacia
+    mensajes más recientes y `before` hacia más antiguos; los cursores de la
+    página se devuelven en las cabeceras X-Prev-Cursor / X-Next-Cursor.
+    
+    Los meses archivados (message_archive.py) se leen de sus archivos Parquet:
+    siempre son anteriores a lo que sigue en la tabla, así que una página
+    empieza en el archivo y continúa en PostgreSQL (o al revés con `before`).
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Usa solo uno de 'before' o 'after'")
+    
     try:
-        async with await db.get_connection() as conn:
-            messages = await conn.fetch("""
+        # Las sesiones eliminadas desaparecen al instante aunque sus mensajes aún no se hayan purgado
+        if not await session_cache.get(session_id):
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        if before:
+            cursor_ts, cursor_id = _decode_cursor(before)
+            messages = await uow.fetch("""
                 SELECT id, content, sender, timestamp, metadata
                 FROM messages 
-                WHERE session_id = $1 
-                ORDER BY timestamp ASC 
-                LIMIT $2
-            """, session_id, limit)
+                WHERE session_id = $1 AND (timestamp, id) < ($2, $3)
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT $4
+            """, session_id, cursor_ts, cursor_id, limit)
+            messages = list(reversed(messages))  # Orden cronológico
             
-            return [
-                {
-                    "id": str(msg['id']),
-                    "content": msg['content'],
-                    "sender": msg['sender'],
-                    "timestamp": msg['timestamp'],
-                    "metadata": json.loads(msg['metadata']) if msg['metadata'] else {}
-                }
-                for msg in messages
-            ]
+            if len(messages) < limit:
+                archives = await message_archive.session_archives(uow, session_id)
+                if archives:
+                    archived = await message_archive.read(
+                        archives, session_id, limit - len(messages), before=(cursor_ts, cursor_id)
+                    )
+                    messages = archived + messages
+        else:
+            cursor = _decode_cursor(after) if after else None
+            archives = await message_archive.session_archives(uow, session_id)
+            messages = []
+            if archives and (cursor is None or cursor[0] <= archives[-1]['last_timestamp']):
+                messages = await message_archive.read(archives, session_id, limit, after=cursor)
             
+            if len(messages) < limit:
+                if cursor:
+                    hot = await uow.fetch("""
+                        SELECT id, content, sender, timestamp, metadata
+                        FROM messages 
+                        WHERE session_id = $1 AND (timestamp, id) > ($2, $3)
+                        ORDER BY timestamp ASC, id ASC 
+                        LIMIT $4
+                    """, session_id, cursor[0], cursor[1], limit - len(messages))
+                else:
+                    hot = await uow.fetch("""
+                        SELECT id, content, sender, timestamp, metadata
+                        FROM messages 
+                        WHERE session_id = $1 
+                        ORDER BY timestamp ASC, id ASC 
+                        LIMIT $2
+                    """, session_id, limit - len(messages))
+                messages = messages + list(hot)
+        
+        if messages:
+            response.headers["X-Prev-Cursor"] = _encode_cursor(messages[0]['timestamp'], messages[0]['id'])
+            response.headers["X-Next-Cursor"] = _encode_cursor(messages[-1]['timestamp'], messages[-1]['id'])
+        
+        return [
+            {
+                "id": str(msg['id']),
+                "content": msg['content'],
+                "sender": msg['sender'],
+                "timestamp": msg['timestamp'],
+                "metadata": json.loads(msg['metadata']) if msg['metadata'] else {}
+            }
+            for msg in messages
+        ]
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo historial: {str(e)}")
+
+@router.get("/registry/stats")
+async def get_registry_stats():
+    """Contadores del registro de agentes (hits/misses/evicciones)"""
+    return agent_registry.stats()
+
+@router.get("/cache/stats")
+async def get_response_cache_stats():
+    """Aciertos, tokens y latencia ahorrados por la caché de respuestas"""
+    return response_cache.stats()
+
+@router.get("/llm/stats")
+async def get_llm_gateway_stats():
+    """Llamadas en vuelo, coalescencia, fallbacks y p95 por proveedor del gateway LLM"""
+    return llm_gateway.stats()
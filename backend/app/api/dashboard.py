@@ -1,76 +1,184 @@
 
-from fastapi import APIRouter, HTTPException, Depends
-from app.models.schemas import DashboardStats
-from app.core.database import get_db
+from fastapi import APIRouter, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect
+from app.models.schemas import DashboardStats, DashboardBatchRequest, DashboardBatchResponse, HourlyStats
+from app.core.unit_of_work import UnitOfWork, get_uow
+from app.core.stats_aggregator import stats_aggregator, hour_bucket, STAT_FIELDS
+from app.core.event_bus import event_bus
+from app.core.session_cache import session_cache
+from typing import List
+from datetime import timedelta
+import asyncio
 
 router = APIRouter()
 
+def _merge_pending(result: DashboardStats) -> DashboardStats:
+    """Suma los incrementos que el agregador aún no ha volcado a la base de datos"""
+    pending = stats_aggregator.pending_for(result.session_id)
+    if not pending:
+        return result
+    
+    result.total_calls += pending['total_calls']
+    result.total_minutes += pending['total_minutes']
+    result.leads += pending['leads']
+    result.scheduled_visits += pending['scheduled_visits']
+    result.messages_count += pending['messages_count']
+    if result.last_activity is None or pending['last_activity'] > result.last_activity:
+        result.last_activity = pending['last_activity']
+    
+    return result
+
+def _row_to_stats(row) -> DashboardStats:
+    """Fila de DASHBOARD_STATS_QUERY (sin fila de stats => contadores en cero)"""
+    return DashboardStats(
+        session_id=row['session_id'],
+        total_calls=row['total_calls'] or 0,
+        total_minutes=row['total_minutes'] or 0,
+        leads=row['leads'] or 0,
+        scheduled_visits=row['scheduled_visits'] or 0,
+        messages_count=row['messages_count'] or 0,
+        last_activity=row['last_activity']
+    )
+
+def _to_stats(row) -> DashboardStats:
+    """Fila de DASHBOARD_STATS_QUERY + incrementos pendientes del agregador"""
+    return _merge_pending(_row_to_stats(row))
+
+@router.post("/batch", response_model=DashboardBatchResponse)
+async def get_dashboard_stats_batch(request: DashboardBatchRequest, uow: UnitOfWork = Depends(get_uow)):
+    """Estadísticas de varias sesiones con una sola consulta"""
+    try:
+        session_ids = list(dict.fromkeys(request.session_ids))
+        
+        rows = await uow.fetch_prepared("dashboard_stats", session_ids)
+        
+        found = {row['session_id']: row for row in rows}
+        return DashboardBatchResponse(
+            stats=[_to_stats(found[sid]) for sid in session_ids if sid in found],
+            missing=[sid for sid in session_ids if sid not in found]
+        )
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
+
 @router.get("/{session_id}", response_model=DashboardStats)
-async def get_dashboard_stats(session_id: str, db = Depends(get_db)):
+async def get_dashboard_stats(session_id: str, uow: UnitOfWork = Depends(get_uow)):
     try:
-        async with await db.get_connection() as conn:
-            # Verificar que la sesión existe
-            session_exists = await conn.fetchval("""
-                SELECT id FROM sessions WHERE id = $1
-            """, session_id)
-            
-            if not session_exists:
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
-            
-            # Obtener estadísticas
-            stats = await conn.fetchrow("""
-                SELECT * FROM stats WHERE session_id = $1
-            """, session_id)
-            
-            # Contar mensajes
-            message_count = await conn.fetchval("""
-                SELECT COUNT(*) FROM messages WHERE session_id = $1
-            """, session_id)
-            
-            if stats:
-                return DashboardStats(
-                    session_id=session_id,
-                    total_calls=stats['total_calls'],
-                    total_minutes=stats['total_minutes'],
-                    leads=stats['leads'],
-                    scheduled_visits=stats['scheduled_visits'],
-                    messages_count=message_count,
-                    last_activity=stats['last_activity']
-                )
-            else:
-                # Crear estadísticas por defecto si no existen
-                await conn.execute("""
-                    INSERT INTO stats (session_id) VALUES ($1)
-                """, session_id)
-                
-                return DashboardStats(
-                    session_id=session_id,
-                    total_calls=0,
-                    total_minutes=0,
-                    leads=0,
-                    scheduled_visits=0,
-                    messages_count=message_count,
-                    last_activity=None
-                )
-            
+        # Existencia y contadores en una sola consulta (messages_count se mantiene incrementalmente)
+        rows = await uow.fetch_prepared("dashboard_stats", [session_id])
+        
+        if not rows:
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        return _to_stats(rows[0])
+    
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
 
+@router.get("/{session_id}/hourly", response_model=List[HourlyStats])
+async def get_hourly_stats(session_id: str, hours: int = Query(24, ge=1, le=24 * 90), uow: UnitOfWork = Depends(get_uow)):
+    """Acumulados por hora (mensajes, leads, visitas, llamadas) de las últimas `hours` horas"""
+    try:
+        # Las horas de stats_hourly están en la zona de la BD; las pendientes, en UTC
+        clock = await uow.fetchrow("""
+            SELECT date_trunc('hour', LOCALTIMESTAMP) AS current_hour,
+                   LOCALTIMESTAMP - (CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AS utc_offset
+        """)
+        since = clock['current_hour'] - timedelta(hours=hours - 1)
+        
+        rows = await uow.fetch("""
+            SELECT bucket, total_calls, total_minutes, leads, scheduled_visits, messages_count
+            FROM stats_hourly
+            WHERE session_id = $1 AND bucket >= $2
+            ORDER BY bucket
+        """, session_id, since)
+        
+        buckets = {row['bucket']: {field: row[field] for field in STAT_FIELDS} for row in rows}
+        
+        # Sumar los incrementos que el agregador aún no ha volcado
+        for utc_bucket, pending in stats_aggregator.pending_hourly_for(session_id).items():
+            bucket = hour_bucket(utc_bucket + clock['utc_offset'])
+            if bucket < since:
+                continue
+            totals = buckets.setdefault(bucket, {field: 0 for field in STAT_FIELDS})
+            for field in STAT_FIELDS:
+                totals[field] += pending[field]
+        
+        return [HourlyStats(bucket=bucket, **totals) for bucket, totals in sorted(buckets.items())]
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas por hora: {str(e)}")
+
+@router.websocket("/{session_id}/ws")
+async def dashboard_updates(websocket: WebSocket, session_id: str, uow: UnitOfWork = Depends(get_uow)):
+    """Dashboard en vivo: un `snapshot` inicial y después los eventos de la sesión.
+    
+    Eventos: `stats` (incrementos de contadores ya volcados), `stats_reset`
+    (valor corregido de un contador), `message` (mensajes nuevos) y `resync`
+    (se perdieron eventos: volver a pedir el snapshot). El snapshot y los
+    eventos de stats llevan la versión de la fila de stats.
+    """
+    subscription = None
+    try:
+        # Primero la suscripción y después la lectura: un volcado confirmado después de
+        # leer publica su evento ya con la suscripción activa, y uno confirmado antes
+        # está en el snapshot. Los eventos con versión <= la del snapshot se descartan.
+        # El snapshot no suma los pendientes del agregador: sus eventos aún no existen
+        subscription = event_bus.subscribe(session_id)
+        rows = await uow.fetch_prepared("dashboard_stats", [session_id])
+        
+        if not rows:
+            await websocket.close(code=4404, reason="Sesión no encontrada")
+            return
+        
+        version = rows[0]['version'] or 0
+        snapshot = _row_to_stats(rows[0]).model_dump(mode="json")
+        
+        await websocket.accept()
+        await websocket.send_json({"type": "snapshot", "session_id": session_id, "version": version,
+                                   "data": snapshot})
+        
+        # Esperar eventos y, a la vez, detectar que el cliente cerró la conexión
+        receiver = asyncio.create_task(websocket.receive_text())
+        try:
+            while True:
+                getter = asyncio.create_task(subscription.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                
+                if getter in done:
+                    event = getter.result()
+                    if event.get("version") is None or event["version"] > version:
+                        await websocket.send_json(event)
+                else:
+                    getter.cancel()
+                
+                if receiver in done:
+                    # Los mensajes del cliente (p. ej. pings) se ignoran; un cierre lanza WebSocketDisconnect
+                    receiver.result()
+                    receiver = asyncio.create_task(websocket.receive_text())
+        finally:
+            receiver.cancel()
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if subscription is not None:
+            event_bus.unsubscribe(subscription)
+
 @router.post("/{session_id}/increment-calls")
-async def increment_calls(session_id: str, minutes: int = 1, db = Depends(get_db)):
+async def increment_calls(session_id: str, minutes: int = 1):
     try:
-        async with await db.get_connection() as conn:
-            await conn.execute("""
-                UPDATE stats SET 
-                    total_calls = total_calls + 1,
-                    total_minutes = total_minutes + $2,
-                    last_activity = CURRENT_TIMESTAMP
-                WHERE session_id = $1
-            """, session_id, minutes)
-            
-            return {"status": "updated", "calls_incremented": 1, "minutes_added": minutes}
-            
+        # Sin esta comprobación el delta de una sesión inexistente o eliminada se perdería al volcar
+        if not await session_cache.get(session_id):
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        # El incremento se vuelca por lotes junto con el resto de sesiones
+        stats_aggregator.add(session_id, total_calls=1, total_minutes=minutes)
+        
+        return {"status": "updated", "calls_incremented": 1, "minutes_added": minutes}
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error actualizando llamadas: {str(e)}")
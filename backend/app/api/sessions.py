@@ -1,114 +1,222 @@
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Body, File, UploadFile
+from pydantic import ValidationError
 from app.models.schemas import SessionCreate, SessionResponse
-from app.core.database import get_db
+from app.core.unit_of_work import UnitOfWork, get_uow
+from app.core.agent_registry import agent_registry
+from app.core.session_cache import session_cache
+from app.core.response_cache import response_cache
+from app.core.campaigns import campaign_manager
+from app.core.prompts import render_system_prompt, prompt_hash
+from app.core.session_purger import session_purger
+from typing import Any, Dict, List, Tuple
+import csv
+import io
+import os
 import uuid
-from datetime import datetime
 
 router = APIRouter()
 
+# Máximo de agencias por petición de alta masiva
+SESSION_BULK_MAX_ROWS = int(os.getenv("SESSION_BULK_MAX_ROWS", "5000"))
+
+SESSION_COLUMNS = ("id", "business_name", "website", "location", "property_types", "working_hours",
+                   "phone", "api_provider", "system_prompt", "system_prompt_hash")
+
 def generate_session_id() -> str:
-    timestamp = int(datetime.now().timestamp())
-    unique_id = str(uuid.uuid4())[:8]
-    return f"session_{timestamp}_{unique_id}"
+    # uuid4 completo (122 bits aleatorios): sin colisiones aunque un lote masivo genere
+    # miles de ids en el mismo segundo
+    return f"session_{uuid.uuid4().hex}"
 
-def generate_system_prompt(session_data: dict) -> str:
-    return f"""Eres un asistente de IA para {session_data['business_name']} ubicada en {session_data['location']}.
+def _validate_sessions(raw_rows: List[Tuple[int, Dict[str, Any]]]) -> Tuple[List[Tuple[int, SessionCreate]], List[dict]]:
+    """Valida cada fila por separado; devuelve (válidas, rechazadas con sus errores)"""
+    valid, rejected = [], []
+    for row, raw in raw_rows:
+        try:
+            if not isinstance(raw, dict):
+                raise TypeError("se esperaba un objeto")
+            valid.append((row, SessionCreate(**raw)))
+        except ValidationError as e:
+            rejected.append({
+                "row": row,
+                "business_name": raw.get('business_name'),
+                "errors": [f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()]
+            })
+        except TypeError as e:
+            rejected.append({"row": row, "business_name": None, "errors": [str(e)]})
+    return valid, rejected
 
-Información de la empresa:
-- Nombre: {session_data['business_name']}
-- Ubicación: {session_data['location']}
-- Tipos de propiedades: {session_data['property_types']}
-- Horarios: {session_data['working_hours']}
-- Teléfono: {session_data['phone']}
-{f"- Sitio web: {session_data['website']}" if session_data.get('website') else ''}
+def _parse_sessions_csv(content: bytes) -> List[Tuple[int, Dict[str, Any]]]:
+    """Filas del CSV como dicts (encabezados = campos de SessionCreate); las celdas vacías se omiten"""
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    return [
+        (reader.line_num, {
+            key.strip().lower(): value.strip()
+            for key, value in record.items()
+            if key and value and value.strip()
+        })
+        for record in reader
+        if any((value or "").strip() for value in record.values() if isinstance(value, str))
+    ]
 
-Tu trabajo es:
-1. Responder consultas sobre propiedades disponibles
-2. Proporcionar información de contacto y horarios
-3. Ser amable y profesional
-4. Capturar información de leads (nombre, teléfono, email, tipo de propiedad buscada)
-5. NO inventar propiedades específicas - deriva a un agente humano para detalles
+async def _create_sessions(uow: UnitOfWork, raw_rows: List[Tuple[int, Dict[str, Any]]]) -> dict:
+    if len(raw_rows) > SESSION_BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote supera el máximo de {SESSION_BULK_MAX_ROWS} sesiones"
+        )
+    
+    valid, rejected = _validate_sessions(raw_rows)
+    if not valid:
+        raise HTTPException(status_code=400, detail={
+            "message": "No hay sesiones válidas en el lote", "rejected": rejected[:100]
+        })
+    
+    # Todos los prompts en una pasada, antes de tocar la BD
+    records = []
+    created = []
+    for row, session in valid:
+        session_id = generate_session_id()
+        system_prompt = render_system_prompt(session.dict())
+        records.append((
+            session_id, session.business_name, session.website, session.location,
+            session.property_types, session.working_hours, session.phone,
+            session.api_provider.value, system_prompt, prompt_hash(system_prompt)
+        ))
+        created.append({"row": row, "session_id": session_id, "business_name": session.business_name})
+    session_ids = [(record[0],) for record in records]
+    
+    # Un COPY por tabla en una sola transacción: o se crean todas o ninguna
+    async with uow.transaction():
+        await uow.copy_records_to_table("sessions", records=records, columns=SESSION_COLUMNS)
+        await uow.copy_records_to_table("agent_configs", records=session_ids, columns=("session_id",))
+        await uow.copy_records_to_table("stats", records=session_ids, columns=("session_id",))
+    
+    return {
+        "created_count": len(created),
+        "sessions": created,
+        "rejected_count": len(rejected),
+        # Solo los primeros rechazos, para no devolver listas enormes
+        "rejected": rejected[:100]
+    }
 
-Siempre mantén un tono profesional pero cercano, y recuerda que representas a {session_data['business_name']}."""
+@router.post("/bulk")
+async def create_sessions_bulk(sessions: List[Any] = Body(...), uow: UnitOfWork = Depends(get_uow)):
+    """Alta masiva desde un array JSON de SessionCreate; las filas inválidas se informan sin abortar el lote"""
+    try:
+        return await _create_sessions(uow, list(enumerate(sessions, start=1)))
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creando sesiones: {str(e)}")
+
+@router.post("/bulk/upload")
+async def upload_sessions_bulk(file: UploadFile = File(...), uow: UnitOfWork = Depends(get_uow)):
+    """Alta masiva desde un CSV con encabezados (business_name, location, phone, ...)"""
+    try:
+        try:
+            raw_rows = _parse_sessions_csv(await file.read())
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=f"CSV inválido: {str(e)}")
+        
+        return await _create_sessions(uow, raw_rows)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creando sesiones: {str(e)}")
 
 @router.post("/", response_model=dict)
-async def create_session(session_data: SessionCreate, db = Depends(get_db)):
+async def create_session(session_data: SessionCreate, uow: UnitOfWork = Depends(get_uow)):
     try:
         session_id = generate_session_id()
-        system_prompt = generate_system_prompt(session_data.dict())
+        # Se renderiza una vez: el agente lo reutiliza byte a byte (caché de prefijos)
+        system_prompt = render_system_prompt(session_data.dict())
         
-        async with await db.get_connection() as conn:
+        async with uow.transaction():
             # Insertar sesión
-            await conn.execute("""
+            await uow.execute("""
                 INSERT INTO sessions (id, business_name, website, location, property_types, 
-                                    working_hours, phone, api_provider, system_prompt)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                                    working_hours, phone, api_provider, system_prompt, system_prompt_hash)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
             """, session_id, session_data.business_name, session_data.website,
                 session_data.location, session_data.property_types, session_data.working_hours,
-                session_data.phone, session_data.api_provider.value, system_prompt)
+                session_data.phone, session_data.api_provider.value, system_prompt,
+                prompt_hash(system_prompt))
             
             # Crear configuración por defecto del agente
-            await conn.execute("""
+            await uow.execute("""
                 INSERT INTO agent_configs (session_id) VALUES ($1)
             """, session_id)
             
             # Crear estadísticas iniciales
-            await conn.execute("""
+            await uow.execute("""
                 INSERT INTO stats (session_id) VALUES ($1)
             """, session_id)
         
         return {"session_id": session_id, "status": "created"}
-        
+    
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creando sesión: {str(e)}")
 
 @router.get("/{session_id}", response_model=SessionResponse)
-async def get_session(session_id: str, db = Depends(get_db)):
+async def get_session(session_id: str):
     try:
-        async with await db.get_connection() as conn:
-            row = await conn.fetchrow("""
-                SELECT * FROM sessions WHERE id = $1
-            """, session_id)
-            
-            if not row:
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
-            
-            return SessionResponse(
-                id=row['id'],
-                business_name=row['business_name'],
-                website=row['website'],
-                location=row['location'],
-                property_types=row['property_types'],
-                working_hours=row['working_hours'],
-                phone=row['phone'],
-                api_provider=row['api_provider'],
-                created_at=row['created_at'],
-                system_prompt=row['system_prompt']
-            )
-            
+        row = await session_cache.get(session_id)
+        
+        if not row:
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        return SessionResponse(
+            id=row['id'],
+            business_name=row['business_name'],
+            website=row['website'],
+            location=row['location'],
+            property_types=row['property_types'],
+            working_hours=row['working_hours'],
+            phone=row['phone'],
+            api_provider=row['api_provider'],
+            created_at=row['created_at'],
+            system_prompt=row['system_prompt']
+        )
+    
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo sesión: {str(e)}")
 
-@router.delete("/{session_id}")
-async def delete_session(session_id: str, db = Depends(get_db)):
+@router.delete("/{session_id}", status_code=202)
+async def delete_session(session_id: str, uow: UnitOfWork = Depends(get_uow)):
+    """Elimina la sesión al instante para la API; sus datos se purgan en segundo plano (session_purger.py)"""
     try:
-        async with await db.get_connection() as conn:
-            # Eliminar en orden por las foreign keys
-            await conn.execute("DELETE FROM stats WHERE session_id = $1", session_id)
-            await conn.execute("DELETE FROM agent_configs WHERE session_id = $1", session_id)
-            await conn.execute("DELETE FROM messages WHERE session_id = $1", session_id)
-            
-            result = await conn.execute("DELETE FROM sessions WHERE id = $1", session_id)
-            
-            if result == "DELETE 0":
-                raise HTTPException(status_code=404, detail="Sesión no encontrada")
-            
-            return {"status": "deleted"}
-            
+        if not await session_purger.request(uow, session_id):
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        
+        await campaign_manager.cancel_session(session_id)
+        await session_cache.invalidate(session_id)
+        agent_registry.invalidate(session_id)
+        response_cache.invalidate_session(session_id)
+        
+        return {"status": "deleted", "purge_status_url": f"/api/sessions/{session_id}/purge"}
+    
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error eliminando sesión: {str(e)}")
+
+@router.get("/{session_id}/purge")
+async def get_purge_status(session_id: str, uow: UnitOfWork = Depends(get_uow)):
+    """Progreso de la purga de una sesión eliminada"""
+    try:
+        purge = await session_purger.status(uow, session_id)
+        
+        if purge is None:
+            raise HTTPException(status_code=404, detail="No hay purga para esta sesión")
+        
+        return purge
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estado de la purga: {str(e)}")
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import hashlib
+import json
+import os
+import time
+from app.core.langraph_agent import CallFlowAgent, resolve_llm_settings, DEFAULT_TEMPERATURE
+from app.core.llm_gateway import llm_gateway, configured_providers
+from app.core.intent_classifier import intent_classifier
+
+class AgentRegistry:
+    """Registro de agentes por proceso.
+    
+    - Un único grafo compilado compartido (ver CallFlowAgent.get_graph).
+    - Clientes LLM del gateway (ver llm_gateway.py), reutilizados por
+      (proveedor, modelo, temperatura) para mantener calientes las conexiones.
+    - Agentes por sesión en un LRU acotado, invalidados cuando cambia la fila
+      de la sesión o su agent_config (detectado por huella de los datos).
+    """
+    
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._agents: "OrderedDict[str, Tuple[str, CallFlowAgent]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def _fingerprint(session_data: Dict) -> str:
+        payload = json.dumps(session_data, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    
+    def get_llm(self, api_provider: str, model: str, temperature: float):
+        """Devuelve el cliente LLM (a través del gateway) para esa combinación"""
+        return llm_gateway.bind(api_provider, model, temperature)
+    
+    def get_agent(self, session_data: Dict) -> CallFlowAgent:
+        """Obtiene el agente de la sesión, reconstruyéndolo solo si sus datos cambiaron"""
+        session_id = session_data['id']
+        fingerprint = self._fingerprint(session_data)
+        
+        entry = self._agents.get(session_id)
+        if entry is not None and entry[0] == fingerprint:
+            self._agents.move_to_end(session_id)
+            self.hits += 1
+            return entry[1]
+        
+        self.misses += 1
+        if entry is not None:
+            self.invalidations += 1
+        
+        llm = self.get_llm(*resolve_llm_settings(session_data))
+        agent = CallFlowAgent(session_data, llm=llm)
+        
+        self._agents[session_id] = (fingerprint, agent)
+        self._agents.move_to_end(session_id)
+        
+        while len(self._agents) > self.max_size:
+            self._agents.popitem(last=False)
+            self.evictions += 1
+        
+        return agent
+    
+    def warm_up(self, providers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Compila el grafo y precarga SDKs/clientes de los proveedores configurados y spaCy.
+        
+        Es síncrono (importaciones): el lifespan lo ejecuta en un hilo mientras abre el pool.
+        """
+        start = time.perf_counter()
+        CallFlowAgent.get_graph()
+        graph_ms = round((time.perf_counter() - start) * 1000, 1)
+        
+        start = time.perf_counter()
+        spacy_loaded = intent_classifier.warm_up()
+        spacy_ms = round((time.perf_counter() - start) * 1000, 1)
+        
+        return {
+            "graph_ms": graph_ms,
+            "providers_ms": llm_gateway.warm_up(providers or configured_providers(), DEFAULT_TEMPERATURE),
+            "spacy_ms": spacy_ms if spacy_loaded else None
+        }
+    
+    def invalidate(self, session_id: str):
+        """Descarta el agente de una sesión (p. ej. al eliminarla o cambiar su config)"""
+        if self._agents.pop(session_id, None) is not None:
+            self.invalidations += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._agents),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "llm_clients": llm_gateway.stats()["clients"]
+        }
+
+# Instancia global del registro de agentes
+agent_registry = AgentRegistry(max_size=int(os.getenv("AGENT_REGISTRY_MAX_SIZE", "256")))
+
+def get_agent_registry():
+    return agent_registry
@@ -0,0 +1,319 @@
+"""Campañas de llamadas masivas.
+
+Una campaña es una lista de teléfonos de una sesión que se marcan en segundo
+plano, con concurrencia acotada por campaña y un tope global de llamadas
+simultáneas del proceso. Los resultados se acumulan en memoria y se escriben
+por lotes: COPY a `campaign_calls`, un UPDATE de los contadores de la campaña
+y un único incremento de `stats` por lote. El progreso se publica a los
+suscriptores (SSE) una vez por intervalo de volcado.
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import os
+import uuid
+from app.core.database import db
+from app.core.metrics import registry
+from app.core.stats_aggregator import stats_aggregator
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CAMPAIGN_CALL_COLUMNS = (
+    'campaign_id', 'session_id', 'phone_number', 'status',
+    'duration_minutes', 'error', 'started_at', 'finished_at'
+)
+
+FINISHED_STATUSES = ('completed', 'cancelled', 'interrupted', 'failed')
+
+# Simulación de llamada (aquí iría la integración real con RetellAI/ElevenLabs)
+CALL_SIMULATION_SECONDS = float(os.getenv("CALL_SIMULATION_SECONDS", "2"))
+SIMULATED_CALL_MINUTES = 3
+
+async def place_call(session: Dict, phone_number: str) -> int:
+    """Realiza una llamada con el agente de la sesión y devuelve su duración en minutos"""
+    await asyncio.sleep(CALL_SIMULATION_SECONDS)
+    return SIMULATED_CALL_MINUTES
+
+class Campaign:
+    """Estado en memoria de una campaña en curso"""
+    
+    def __init__(self, campaign_id: str, session: Dict, phone_numbers: List[str], concurrency: int):
+        self.id = campaign_id
+        self.session = session
+        self.session_id = session['id']
+        self.phone_numbers = phone_numbers
+        self.concurrency = concurrency
+        self.status = 'queued'
+        self.completed = 0
+        self.failed = 0
+        self.minutes = 0
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        # Resultados aún no escritos en campaign_calls
+        self.results: List[Tuple] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.flush_lock = asyncio.Lock()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "total_calls": len(self.phone_numbers),
+            "completed_calls": self.completed,
+            "failed_calls": self.failed,
+            "pending_calls": len(self.phone_numbers) - self.completed - self.failed,
+            "total_minutes": self.minutes,
+            "concurrency": self.concurrency,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class CampaignManager:
+    """Cola de campañas con un pool de workers por campaña y escritura por lotes"""
+    
+    def __init__(self, max_active_calls: int = 100, default_concurrency: int = 10,
+                 max_concurrency: int = 50, max_calls: int = 10000,
+                 batch_size: int = 200, flush_interval: float = 1.0):
+        self.max_active_calls = max_active_calls
+        self.default_concurrency = default_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_calls = max_calls
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._campaigns: Dict[str, Campaign] = {}
+        self.active_calls = 0
+        self.calls_placed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+    
+    async def create(self, session: Dict, phone_numbers: List[str],
+                     concurrency: Optional[int] = None) -> Campaign:
+        """Registra la campaña y la encola en segundo plano"""
+        if len(phone_numbers) > self.max_calls:
+            raise ValueError(f"La campaña supera el máximo de {self.max_calls} llamadas")
+        
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_active_calls)
+        
+        concurrency = max(1, min(concurrency or self.default_concurrency, self.max_concurrency))
+        campaign = Campaign(f"campaign_{uuid.uuid4().hex[:12]}", session, phone_numbers, concurrency)
+        
+        async with await db.get_connection() as conn:
+            await conn.execute("""
+                INSERT INTO call_campaigns (id, session_id, status, total_calls, concurrency, created_at)
+                VALUES ($1, $2, 'queued', $3, $4, $5)
+            """, campaign.id, campaign.session_id, len(phone_numbers), concurrency, campaign.created_at)
+        
+        self._campaigns[campaign.id] = campaign
+        campaign.task = asyncio.create_task(self._run(campaign))
+        return campaign
+    
+    def get(self, campaign_id: str) -> Optional[Campaign]:
+        """Campaña en curso en este proceso (None si terminó o no existe)"""
+        return self._campaigns.get(campaign_id)
+    
+    def cancel(self, campaign_id: str) -> bool:
+        """Deja de marcar números nuevos; las llamadas en curso terminan normalmente"""
+        campaign = self._campaigns.get(campaign_id)
+        if campaign is None:
+            return False
+        campaign.cancelled = True
+        return True
+    
+    async def cancel_session(self, session_id: str):
+        """Cancela las campañas de la sesión y espera a que guarden sus resultados"""
+        tasks = []
+        for campaign in self._campaigns.values():
+            if campaign.session_id == session_id:
+                campaign.cancelled = True
+                if campaign.task is not None:
+                    tasks.append(campaign.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def subscribe(self, campaign: Campaign) -> asyncio.Queue:
+        """Cola de eventos (evento, datos) de progreso de la campaña"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        if campaign.status in FINISHED_STATUSES:
+            queue.put_nowait(("done", campaign.snapshot()))
+        else:
+            campaign.subscribers.append(queue)
+        return queue
+    
+    def unsubscribe(self, campaign: Campaign, queue: asyncio.Queue):
+        if queue in campaign.subscribers:
+            campaign.subscribers.remove(queue)
+    
+    def _publish(self, campaign: Campaign, event: str):
+        data = campaign.snapshot()
+        for queue in campaign.subscribers:
+            # El progreso es una foto completa: si el cliente va atrasado, se descarta la más vieja
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+    
+    async def _run(self, campaign: Campaign):
+        workers: List[asyncio.Task] = []
+        status = 'completed'
+        try:
+            campaign.status = 'running'
+            campaign.started_at = datetime.now()
+            async with await db.get_connection() as conn:
+                await conn.execute(
+                    "UPDATE call_campaigns SET status = 'running', started_at = $2 WHERE id = $1",
+                    campaign.id, campaign.started_at
+                )
+            
+            # Iterador compartido: cada worker toma el siguiente número libre
+            numbers = iter(campaign.phone_numbers)
+            workers = [
+                asyncio.create_task(self._worker(campaign, numbers))
+                for _ in range(min(campaign.concurrency, len(campaign.phone_numbers)))
+            ]
+            
+            pending = set(workers)
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=self.flush_interval)
+                await self._flush_safely(campaign)
+                self._publish(campaign, "progress")
+            
+            for worker in workers:
+                worker.result()
+            
+            if campaign.cancelled:
+                status = 'cancelled'
+        
+        except asyncio.CancelledError:
+            # Apagado del proceso: se guarda lo hecho y la campaña queda interrumpida
+            status = 'interrupted'
+        except Exception:
+            logger.error("Error en campaña", campaign_id=campaign.id, exc_info=True)
+            status = 'failed'
+        
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await self._finish(campaign, status)
+    
+    async def _worker(self, campaign: Campaign, numbers):
+        for phone_number in numbers:
+            if campaign.cancelled:
+                return
+            
+            async with self._slots:
+                started_at = datetime.now()
+                self.active_calls += 1
+                try:
+                    minutes = await place_call(campaign.session, phone_number)
+                    status, error = 'completed', None
+                    campaign.completed += 1
+                    campaign.minutes += minutes
+                except Exception as e:
+                    minutes, status, error = 0, 'failed', str(e)[:500]
+                    campaign.failed += 1
+                finally:
+                    self.active_calls -= 1
+            
+            self.calls_placed += 1
+            campaign.results.append((
+                campaign.id, campaign.session_id, phone_number, status,
+                minutes, error, started_at, datetime.now()
+            ))
+            
+            if len(campaign.results) >= self.batch_size:
+                await self._flush_safely(campaign)
+    
+    async def _flush(self, campaign: Campaign):
+        """Escribe los resultados pendientes con COPY y actualiza contadores en la misma transacción"""
+        async with campaign.flush_lock:
+            if not campaign.results:
+                return
+            
+            batch, campaign.results = campaign.results, []
+            completed = sum(1 for record in batch if record[3] == 'completed')
+            minutes = sum(record[4] for record in batch)
+            
+            try:
+                async with await db.get_connection() as conn:
+                    async with conn.transaction():
+                        await conn.copy_records_to_table(
+                            'campaign_calls', records=batch, columns=CAMPAIGN_CALL_COLUMNS
+                        )
+                        await conn.execute("""
+                            UPDATE call_campaigns SET
+                                completed_calls = completed_calls + $2,
+                                failed_calls = failed_calls + $3,
+                                total_minutes = total_minutes + $4
+                            WHERE id = $1
+                        """, campaign.id, completed, len(batch) - completed, minutes)
+            except BaseException:
+                # Reintentar en el próximo volcado sin perder el orden (también si se cancela)
+                self.flush_errors += 1
+                campaign.results[:0] = batch
+                raise
+            
+            # Un único incremento de estadísticas por lote
+            if completed:
+                stats_aggregator.add(campaign.session_id, total_calls=completed, total_minutes=minutes)
+            self.flushes += 1
+    
+    async def _flush_safely(self, campaign: Campaign):
+        try:
+            await self._flush(campaign)
+        except Exception:
+            logger.error("Error guardando resultados de la campaña", campaign_id=campaign.id, exc_info=True)
+    
+    async def _finish(self, campaign: Campaign, status: str):
+        await self._flush_safely(campaign)
+        if campaign.results:
+            logger.warning("Campaña con resultados sin guardar", campaign_id=campaign.id,
+                           unsaved=len(campaign.results))
+        
+        campaign.finished_at = datetime.now()
+        try:
+            async with await db.get_connection() as conn:
+                await conn.execute(
+                    "UPDATE call_campaigns SET status = $2, finished_at = $3 WHERE id = $1",
+                    campaign.id, status, campaign.finished_at
+                )
+        except Exception:
+            logger.error("Error cerrando campaña", campaign_id=campaign.id, exc_info=True)
+        
+        campaign.status = status
+        self._publish(campaign, "done")
+        self._campaigns.pop(campaign.id, None)
+    
+    async def stop(self):
+        """Interrumpe las campañas en curso guardando los resultados ya obtenidos"""
+        tasks = [c.task for c in self._campaigns.values() if c.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_campaigns": len(self._campaigns),
+            "active_calls": self.active_calls,
+            "max_active_calls": self.max_active_calls,
+            "calls_placed": self.calls_placed,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors
+        }
+
+# Instancia global del gestor de campañas
+campaign_manager = CampaignManager(
+    max_active_calls=int(os.getenv("CAMPAIGN_MAX_ACTIVE_CALLS", "100")),
+    default_concurrency=int(os.getenv("CAMPAIGN_DEFAULT_CONCURRENCY", "10")),
+    max_concurrency=int(os.getenv("CAMPAIGN_MAX_CONCURRENCY", "50")),
+    max_calls=int(os.getenv("CAMPAIGN_MAX_CALLS", "10000")),
+    batch_size=int(os.getenv("CAMPAIGN_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("CAMPAIGN_FLUSH_INTERVAL", "1.0"))
+)
+
+registry.gauge("campaign_active_calls", "Llamadas de campaña en curso", lambda: campaign_manager.active_calls)
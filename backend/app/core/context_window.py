@@ -0,0 +1,132 @@
+from typing import Dict, List, NamedTuple, Any
+import hashlib
+import os
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from app.core.logging_config import get_logger
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken es opcional: sin él se estima por caracteres
+    _encoding = None
+
+logger = get_logger(__name__)
+
+# Máximo de mensajes que se incorporan al resumen en una actualización; el
+# resto sigue sin resumir y entra en la siguiente
+CONTEXT_SUMMARY_MAX_MESSAGES = int(os.getenv("CONTEXT_SUMMARY_MAX_MESSAGES", "50"))
+
+# Máximo de mensajes recientes en la ventana (además del presupuesto de tokens);
+# acota también cuántos mensajes se leen de la BD por turno
+CONTEXT_WINDOW_MAX_MESSAGES = int(os.getenv("CONTEXT_WINDOW_MAX_MESSAGES", "40"))
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+class ContextWindow(NamedTuple):
+    messages: List[Any]
+    overflow: List[Dict]
+    tokens: int
+    
+    @property
+    def digest(self) -> str:
+        """Hash de lo que ve el LLM además del prompt (resumen + mensajes); '' sin contexto"""
+        if not self.messages:
+            return ""
+        hasher = hashlib.sha1()
+        for message in self.messages:
+            hasher.update(f"{message.type}\x00{message.content}\x00".encode("utf-8"))
+        return hasher.hexdigest()
+
+SUMMARY_PROMPT = """Eres el encargado de mantener el resumen de una conversación entre un cliente y el asistente de una inmobiliaria.
+Actualiza el resumen existente incorporando los mensajes nuevos. Conserva datos del cliente (nombre, contacto, presupuesto, zona, tipo de propiedad), citas acordadas y preguntas pendientes.
+Responde solo con el resumen actualizado, en español y en menos de {max_words} palabras."""
+
+class ContextWindowManager:
+    """Construye la lista de mensajes para el LLM a partir del historial, dentro de un presupuesto de tokens.
+    
+    El resumen acumulado de la sesión va primero; después, los mensajes más
+    recientes que quepan. Los más antiguos que no caben (`overflow`) son el
+    delta que hay que incorporar al resumen, de modo que cada turno solo
+    resume lo nuevo en lugar de reenviar o re-resumir toda la conversación.
+    """
+    
+    def __init__(self, token_budget: int = 1500, summary_max_tokens: int = 300, max_messages: int = 40):
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.max_messages = max_messages
+    
+    def build(self, history: List[Dict], summary: str = "") -> ContextWindow:
+        """`history` en orden cronológico, con 'id', 'content' y 'sender'"""
+        messages: List[Any] = []
+        used = 0
+        
+        if summary:
+            summary_text = f"Resumen de la conversación hasta ahora:\n{summary}"
+            used += estimate_tokens(summary_text)
+            messages.append(SystemMessage(content=summary_text))
+        
+        recent: List[Any] = []
+        cutoff = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            message = history[index]
+            tokens = estimate_tokens(message['content'])
+            if used + tokens > self.token_budget or len(recent) >= self.max_messages:
+                break
+            used += tokens
+            cutoff = index
+            message_class = AIMessage if message['sender'] == 'ai' else HumanMessage
+            recent.append(message_class(content=message['content']))
+        
+        messages.extend(reversed(recent))
+        return ContextWindow(messages, history[:cutoff], used)
+    
+    async def summarize(self, llm, previous_summary: str, delta: List[Dict]) -> str:
+        """Incorpora solo los mensajes nuevos (`delta`) al resumen previo"""
+        transcript = "\n".join(
+            f"{'Asistente' if m['sender'] == 'ai' else 'Cliente'}: {m['content']}" for m in delta
+        )
+        response = await llm.ainvoke([
+            SystemMessage(content=SUMMARY_PROMPT.format(max_words=int(self.summary_max_tokens * 0.75))),
+            HumanMessage(content=f"Resumen actual:\n{previous_summary or '(vacío)'}\n\nMensajes nuevos:\n{transcript}")
+        ])
+        return response.content.strip()
+
+async def update_summary(uow, llm, session_id: str, previous_summary: str, previous_until_id: int,
+                         delta: List[Dict]):
+    """Tarea en segundo plano: resume el delta y persiste el resumen y hasta qué mensaje cubre.
+    
+    `previous_until_id` es el summarized_until_id leído junto a `previous_summary`.
+    """
+    if not delta:
+        return
+    # Los más antiguos primero: summarized_until_id nunca salta mensajes sin resumir
+    delta = delta[:CONTEXT_SUMMARY_MAX_MESSAGES]
+    
+    try:
+        summary = await context_window_manager.summarize(llm, previous_summary, delta)
+        # Solo avanzar, y solo desde el resumen del que partimos: si una petición concurrente
+        # ya lo actualizó, este se descarta (partía de un resumen viejo y pisaría el suyo)
+        await uow.execute("""
+            INSERT INTO conversation_summaries (session_id, summary, summarized_until_id, updated_at)
+            VALUES ($1, $2, $3, CURRENT_TIMESTAMP)
+            ON CONFLICT (session_id) DO UPDATE SET
+                summary = EXCLUDED.summary,
+                summarized_until_id = EXCLUDED.summarized_until_id,
+                updated_at = EXCLUDED.updated_at
+            WHERE conversation_summaries.summarized_until_id = $4
+              AND conversation_summaries.summarized_until_id < EXCLUDED.summarized_until_id
+        """, session_id, summary, max(m['id'] for m in delta), previous_until_id)
+    except Exception:
+        logger.error("Error actualizando resumen de conversación", session_id=session_id, exc_info=True)
+
+# Instancia global del gestor de contexto
+context_window_manager = ContextWindowManager(
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+    summary_max_tokens=int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300")),
+    max_messages=CONTEXT_WINDOW_MAX_MESSAGES
+)
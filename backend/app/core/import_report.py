@@ -0,0 +1,82 @@
+"""Coste de importación de módulos, para vigilar el arranque de los workers.
+
+- `timed_import(nombre)`: importa un módulo bajo demanda (SDKs de proveedores
+  LLM, spaCy) y guarda cuánto tardó; el lifespan lo incluye en el log de
+  arranque.
+- `python -m app.core.import_report`: importa `app.main` en un proceso limpio
+  con `python -X importtime` y muestra el coste por paquete, para ver qué
+  dependencia pesa en el arranque.
+"""
+from typing import Dict, List, Tuple
+import argparse
+import importlib
+import re
+import subprocess
+import sys
+import time
+
+_lazy_imports: Dict[str, float] = {}
+
+# "import time:       self [us] |    cumulative | imported package"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S.*)$")
+
+def timed_import(module_name: str):
+    """importlib.import_module que registra el coste de la primera importación"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _lazy_imports[module_name] = round((time.perf_counter() - start) * 1000, 1)
+    return module
+
+def lazy_imports() -> Dict[str, float]:
+    """Módulos importados bajo demanda en este proceso y su coste (ms)"""
+    return dict(_lazy_imports)
+
+def measure(module_name: str = "app.main") -> Tuple[float, List[Tuple[str, float, int]]]:
+    """Importa el módulo en un subproceso con -X importtime.
+
+    Devuelve (total ms, [(paquete raíz, ms propios, módulos)]) ordenado por coste.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "import fallido")
+
+    packages: Dict[str, List[int]] = {}
+    total_us = 0
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us = int(match.group(1))
+        root = match.group(3).strip().split(".")[0]
+        entry = packages.setdefault(root, [0, 0])
+        entry[0] += self_us
+        entry[1] += 1
+        total_us += self_us
+
+    ranking = sorted(
+        ((root, round(us / 1000, 1), count) for root, (us, count) in packages.items()),
+        key=lambda item: item[1], reverse=True
+    )
+    return round(total_us / 1000, 1), ranking
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de importación por paquete")
+    parser.add_argument("module", nargs="?", default="app.main")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    total_ms, ranking = measure(args.module)
+    print(f"Importar {args.module}: {total_ms} ms")
+    print(f"{'paquete':<32} {'ms':>10} {'%':>6} {'módulos':>8}")
+    for root, ms, count in ranking[:args.top]:
+        share = ms / total_ms * 100 if total_ms else 0
+        print(f"{root:<32} {ms:>10.1f} {share:>6.1f} {count:>8}")
+
+if __name__ == "__main__":
+    main()
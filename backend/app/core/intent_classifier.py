@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, NamedTuple, Any
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from app.core.import_report import timed_import
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Diccionario por defecto (el mismo que usaba classifier_node)
+DEFAULT_INTENTS: Dict[str, List[str]] = {
+    'lead_capture': ['mi nombre', 'me llamo', 'contacto', 'teléfono', 'email'],
+    'appointment': ['cita', 'visita', 'ver', 'agendar', 'reunión']
+}
+
+# Intenciones que el grafo sabe enrutar, en orden de prioridad ante empates sin desempate
+ROUTABLE_INTENTS = ('lead_capture', 'appointment')
+
+DEFAULT_INTENT = 'general'
+
+# Confianza asignada cuando ninguna palabra clave coincide: 'general' es el camino seguro
+NO_MATCH_CONFIDENCE = 0.7
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin acentos ('Reunión' -> 'reunion'), para comparar de forma robusta"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+class IntentResult(NamedTuple):
+    intent: str
+    confidence: float
+    source: str
+    scores: Dict[str, int]
+    
+    @property
+    def ambiguous(self) -> bool:
+        return self.confidence < IntentClassifier.confidence_threshold
+
+def _score(scores: Dict[str, int], source: str, confidence_cap: float = 1.0) -> Optional[IntentResult]:
+    """Convierte conteos por intención en un resultado; None si no hubo coincidencias"""
+    ranked = sorted(
+        ((count, -ROUTABLE_INTENTS.index(intent), intent) for intent, count in scores.items() if count),
+        reverse=True
+    )
+    if not ranked:
+        return None
+    
+    top = ranked[0][0]
+    second = ranked[1][0] if len(ranked) > 1 else 0
+    # Empate -> 0.5 (ambiguo); cada coincidencia de ventaja suma 0.25
+    confidence = min(confidence_cap, 0.5 + 0.25 * (top - second))
+    return IntentResult(ranked[0][2], confidence, source, scores)
+
+class KeywordMatcher:
+    """Matcher compilado una sola vez: una única regex con límites de palabra sobre texto sin acentos"""
+    
+    def __init__(self, intents: Dict[str, List[str]]):
+        self.intents = {intent: list(words) for intent, words in intents.items() if intent in ROUTABLE_INTENTS}
+        self._groups: Dict[str, str] = {}
+        
+        alternatives = []
+        for index, (intent, words) in enumerate(self.intents.items()):
+            # Las frases más largas primero para que 'mi nombre' gane a 'nombre'
+            folded = sorted({fold_text(w).strip() for w in words if w.strip()}, key=len, reverse=True)
+            if not folded:
+                continue
+            group = f"i{index}"
+            self._groups[group] = intent
+            pattern = "|".join(r"\s+".join(re.escape(part) for part in word.split()) for word in folded)
+            alternatives.append(f"(?P<{group}>{pattern})")
+        
+        self._regex = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b") if alternatives else None
+    
+    def match(self, folded_text: str) -> Dict[str, int]:
+        scores = {intent: 0 for intent in self.intents}
+        if self._regex is None:
+            return scores
+        for match in self._regex.finditer(folded_text):
+            scores[self._groups[match.lastgroup]] += 1
+        return scores
+
+class LemmaMatcher:
+    """Segundo nivel opcional con spaCy: compara lemas ('agendamos' -> 'agendar')"""
+    
+    def __init__(self, nlp, intents: Dict[str, List[str]]):
+        self.nlp = nlp
+        self.lemmas: Dict[str, set] = {}
+        for intent, words in intents.items():
+            if intent not in ROUTABLE_INTENTS:
+                continue
+            # Solo palabras sueltas: las frases ya las cubre la regex
+            single = [w for w in words if len(w.split()) == 1]
+            self.lemmas[intent] = {fold_text(token.lemma_) for doc in nlp.pipe(single) for token in doc}
+    
+    def match(self, text: str) -> Dict[str, int]:
+        lemmas = [fold_text(token.lemma_) for token in self.nlp(text)]
+        return {
+            intent: sum(1 for lemma in lemmas if lemma in keywords)
+            for intent, keywords in self.lemmas.items()
+        }
+
+class _CompiledDictionary:
+    """Matchers de un diccionario de intenciones; el de lemas se construye al primer uso"""
+    
+    def __init__(self, intents: Dict[str, List[str]]):
+        self.keywords = KeywordMatcher(intents)
+        self.lemmas: Optional[LemmaMatcher] = None
+
+class IntentClassifier:
+    """Clasificador de intención por niveles: regex compilada -> lemas spaCy (opcional).
+    
+    Devuelve una confianza; los mensajes ambiguos (por debajo de
+    `confidence_threshold`) son los únicos que deberían llegar a un LLM.
+    Los diccionarios por sesión se compilan una vez y se comparten en un LRU.
+    
+    El nivel de spaCy es bloqueante (carga del modelo, lematización): desde
+    código async se usa `aclassify`, que lo ejecuta en un hilo. El modelo se
+    carga en el arranque (lifespan) cuando INTENT_SPACY_ENABLED está activo.
+    """
+    
+    confidence_threshold = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.6"))
+    
+    def __init__(self, max_dictionaries: int = 128, use_spacy: bool = False,
+                 spacy_model: str = "es_core_news_sm"):
+        self.max_dictionaries = max_dictionaries
+        self.use_spacy = use_spacy
+        self.spacy_model = spacy_model
+        self._nlp = None
+        # Serializa la carga del modelo, la construcción de lemas y las llamadas a nlp()
+        self._spacy_lock = threading.Lock()
+        self._dictionaries: "OrderedDict[str, _CompiledDictionary]" = OrderedDict()
+        self._default = _CompiledDictionary(DEFAULT_INTENTS)
+    
+    def _load_nlp(self):
+        if self._nlp is None and self.use_spacy:
+            try:
+                spacy = timed_import("spacy")
+                self._nlp = spacy.load(self.spacy_model, disable=["parser", "ner"])
+            except Exception as e:  # Modelo no instalado: se continúa solo con la regex
+                logger.warning("spaCy no disponible para clasificar intención", error=str(e))
+                self.use_spacy = False
+        return self._nlp
+    
+    def warm_up(self) -> bool:
+        """Carga spaCy y los lemas del diccionario por defecto si están activos (arranque)"""
+        with self._spacy_lock:
+            if self._load_nlp() is None:
+                return False
+            if self._default.lemmas is None:
+                self._default.lemmas = LemmaMatcher(self._nlp, self._default.keywords.intents)
+            return True
+    
+    def _dictionary_for(self, overrides: Optional[Any]) -> _CompiledDictionary:
+        """Diccionario de la sesión (sus intenciones reemplazan las por defecto)"""
+        if isinstance(overrides, str):
+            overrides = json.loads(overrides)
+        if not overrides:
+            return self._default
+        
+        key = hashlib.sha1(json.dumps(overrides, sort_keys=True).encode("utf-8")).hexdigest()
+        dictionary = self._dictionaries.get(key)
+        if dictionary is None:
+            dictionary = _CompiledDictionary({**DEFAULT_INTENTS, **overrides})
+            self._dictionaries[key] = dictionary
+            while len(self._dictionaries) > self.max_dictionaries:
+                self._dictionaries.popitem(last=False)
+        self._dictionaries.move_to_end(key)
+        return dictionary
+    
+    def _lemma_result(self, dictionary: _CompiledDictionary, message: str) -> Optional[IntentResult]:
+        """Nivel de spaCy (bloqueante)"""
+        with self._spacy_lock:
+            if dictionary.lemmas is None and self._load_nlp() is not None:
+                dictionary.lemmas = LemmaMatcher(self._nlp, dictionary.keywords.intents)
+            if dictionary.lemmas is None:
+                return None
+            return _score(dictionary.lemmas.match(message), "lemmas", confidence_cap=0.8)
+    
+    @staticmethod
+    def _pick(result: Optional[IntentResult], lemma_result: Optional[IntentResult]) -> IntentResult:
+        if lemma_result is not None and (result is None or lemma_result.confidence > result.confidence):
+            result = lemma_result
+        if result is None:
+            return IntentResult(DEFAULT_INTENT, NO_MATCH_CONFIDENCE, "default", {})
+        return result
+    
+    def classify(self, message: str, overrides: Optional[Any] = None) -> IntentResult:
+        """Versión síncrona (scripts y pruebas); bloquea mientras spaCy trabaja"""
+        dictionary = self._dictionary_for(overrides)
+        
+        result = _score(dictionary.keywords.match(fold_text(message)), "keywords")
+        if result is not None and not result.ambiguous:
+            return result
+        
+        lemma_result = self._lemma_result(dictionary, message) if self.use_spacy else None
+        return self._pick(result, lemma_result)
+    
+    async def aclassify(self, message: str, overrides: Optional[Any] = None) -> IntentResult:
+        """La regex corre en línea; solo los mensajes ambiguos pasan por spaCy, en un hilo"""
+        dictionary = self._dictionary_for(overrides)
+        
+        result = _score(dictionary.keywords.match(fold_text(message)), "keywords")
+        if result is not None and not result.ambiguous:
+            return result
+        
+        lemma_result = None
+        if self.use_spacy:
+            lemma_result = await asyncio.to_thread(self._lemma_result, dictionary, message)
+        return self._pick(result, lemma_result)
+
+# Instancia global compartida por todas las sesiones
+intent_classifier = IntentClassifier(
+    use_spacy=os.getenv("INTENT_SPACY_ENABLED", "false").lower() in ("1", "true", "yes"),
+    spacy_model=os.getenv("INTENT_SPACY_MODEL", "es_core_news_sm")
+)
@@ -1,13 +1,47 @@
-
 from typing import Dict, Any, List
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 import json
 import os
+import time
 from datetime import datetime
+from app.core.intent_classifier import intent_classifier, IntentClassifier, ROUTABLE_INTENTS
+from app.core.response_cache import response_cache
+from app.core.context_window import context_window_manager
+from app.core.prompts import session_prompt, build_messages, cache_usage
+from app.core.llm_gateway import llm_gateway, DEFAULT_MODELS, LLM_PROVIDER_OVERRIDE, provider_available
+from app.core.tracing import tracer
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_TEMPERATURE = 0.7
+
+# Consultar al LLM cuando el clasificador local no está seguro de la intención
+INTENT_LLM_FALLBACK = os.getenv("INTENT_LLM_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+def resolve_llm_settings(session_data: Dict) -> tuple:
+    """Obtiene (proveedor, modelo, temperatura) a partir de la sesión y su agent_config"""
+    api_provider = LLM_PROVIDER_OVERRIDE or session_data.get('api_provider', 'openai')
+    if api_provider not in DEFAULT_MODELS or (
+        api_provider in ('openrouter', 'google') and not provider_available(api_provider)
+    ):
+        # Default to OpenAI
+        api_provider = 'openai'
+    
+    temperature = session_data.get('temperature')
+    temperature = float(temperature) if temperature is not None else DEFAULT_TEMPERATURE
+    
+    return api_provider, DEFAULT_MODELS[api_provider], temperature
+
+def _total_tokens(response) -> int:
+    """Tokens consumidos por una respuesta del LLM (0 si el proveedor no los informa)"""
+    usage = getattr(response, 'usage_metadata', None) or {}
+    if usage.get('total_tokens'):
+        return usage['total_tokens']
+    token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+    return token_usage.get('total_tokens', 0)
 
 class ConversationState:
     def __init__(self):
@@ -19,45 +53,55 @@ class ConversationState:
         self.metadata: Dict = {}
 
 class CallFlowAgent:
-    def __init__(self, session_data: Dict):
+    """Contexto de una sesión que se liga al grafo compartido en cada invocación.
+    
+    El grafo se compila una sola vez por proceso; cada nodo obtiene el agente
+    de la sesión desde `config["configurable"]["agent"]`.
+    """
+    _graph = None
+    
+    def __init__(self, session_data: Dict, llm=None):
         self.session_data = session_data
-        self.llm = self._init_llm()
-        self.graph = self._create_graph()
+        self.llm = llm if llm is not None else self._init_llm()
+        # Prompt renderizado al crear la sesión: idéntico en todos los turnos
+        self.system_prompt, self.system_prompt_hash = session_prompt(session_data)
     
     def _init_llm(self):
-        api_provider = self.session_data.get('api_provider', 'openai')
-        
-        if api_provider == 'openai':
-            return ChatOpenAI(
-                model="gpt-4",
-                temperature=0.7,
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-        elif api_provider == 'anthropic':
-            return ChatAnthropic(
-                model="claude-3-sonnet-20240229",
-                temperature=0.7,
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
-        else:
-            # Default to OpenAI
-            return ChatOpenAI(
-                model="gpt-4",
-                temperature=0.7,
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-    
-    def _create_graph(self):
+        return llm_gateway.bind(*resolve_llm_settings(self.session_data))
+    
+    @classmethod
+    def get_graph(cls):
+        """Devuelve el grafo compilado compartido por todas las sesiones"""
+        if cls._graph is None:
+            with tracer.span("graph.build"):
+                cls._graph = cls._create_graph()
+        return cls._graph
+    
+    @staticmethod
+    def _bind_node(node_name: str):
+        """Adapta un método de nodo para que use el agente ligado en la invocación (y lo mide)"""
+        span_name = "node." + node_name.removesuffix("_node")
+        
+        async def node(state: Dict, config: RunnableConfig) -> Dict:
+            agent = config["configurable"]["agent"]
+            with tracer.span(span_name):
+                return await getattr(agent, node_name)(state)
+        
+        node.__name__ = node_name
+        return node
+    
+    @classmethod
+    def _create_graph(cls):
         workflow = StateGraph(dict)
         
         # Definir nodos
-        workflow.add_node("entry", self.entry_node)
-        workflow.add_node("context_loader", self.context_loader_node)
-        workflow.add_node("classifier", self.classifier_node)
-        workflow.add_node("general_response", self.general_response_node)
-        workflow.add_node("lead_capture", self.lead_capture_node)
-        workflow.add_node("appointment_scheduler", self.appointment_scheduler_node)
-        workflow.add_node("finalizer", self.finalizer_node)
+        workflow.add_node("entry", cls._bind_node("entry_node"))
+        workflow.add_node("context_loader", cls._bind_node("context_loader_node"))
+        workflow.add_node("classifier", cls._bind_node("classifier_node"))
+        workflow.add_node("general_response", cls._bind_node("general_response_node"))
+        workflow.add_node("lead_capture", cls._bind_node("lead_capture_node"))
+        workflow.add_node("appointment_scheduler", cls._bind_node("appointment_scheduler_node"))
+        workflow.add_node("finalizer", cls._bind_node("finalizer_node"))
         
         # Definir flujo
         workflow.set_entry_point("entry")
@@ -67,7 +111,7 @@ class CallFlowAgent:
         # Condicionales desde classifier
         workflow.add_conditional_edges(
             "classifier",
-            self.route_conversation,
+            cls.route_conversation,
             {
                 "general": "general_response",
                 "lead_capture": "lead_capture",
@@ -85,7 +129,7 @@ class CallFlowAgent:
     
     async def entry_node(self, state: Dict) -> Dict:
         """Nodo de entrada - procesa el mensaje inicial"""
-        print(f"🚀 Entry Node - Procesando: {state.get('user_message', '')}")
+        tracer.annotate(session_id=self.session_data.get('id'), message_chars=len(state.get('user_message', '')))
         
         state['timestamp'] = datetime.now().isoformat()
         state['session_data'] = self.session_data
@@ -94,8 +138,6 @@ class CallFlowAgent:
     
     async def context_loader_node(self, state: Dict) -> Dict:
         """Carga el contexto de la inmobiliaria"""
-        print("📚 Context Loader - Cargando contexto de la inmobiliaria")
-        
         context = {
             "business_name": self.session_data.get('business_name'),
             "location": self.session_data.get('location'),
@@ -106,63 +148,115 @@ class CallFlowAgent:
         }
         
         state['context'] = context
+        
+        # Historial dentro del presupuesto de tokens. Lo que no cabe se resume después
+        # sea cual sea la ruta: si no, esos mensajes nunca llegarían al resumen
+        window = context_window_manager.build(
+            state.get('conversation_history', []), state.get('conversation_summary', '')
+        )
+        state['context_window'] = window
+        state['summary_delta'] = window.overflow
         return state
     
     async def classifier_node(self, state: Dict) -> Dict:
         """Clasifica el tipo de consulta del usuario"""
-        print("🔍 Classifier - Analizando intención del usuario")
+        user_message = state.get('user_message', '')
         
-        user_message = state.get('user_message', '').lower()
+        # Regex compilada (y lemas si están activos) con el diccionario de la sesión
+        result = await intent_classifier.aclassify(user_message, self.session_data.get('intent_keywords'))
+        intent, confidence, source = result.intent, result.confidence, result.source
         
-        # Clasificación simple basada en palabras clave
-        if any(word in user_message for word in ['mi nombre', 'me llamo', 'contacto', 'teléfono', 'email']):
-            intent = 'lead_capture'
-        elif any(word in user_message for word in ['cita', 'visita', 'ver', 'agendar', 'reunión']):
-            intent = 'appointment'
-        else:
-            intent = 'general'
+        # Solo los mensajes ambiguos pagan una llamada al LLM
+        if result.ambiguous and INTENT_LLM_FALLBACK:
+            llm_intent = await self._classify_with_llm(user_message)
+            if llm_intent:
+                intent, confidence, source = llm_intent, IntentClassifier.confidence_threshold, 'llm'
         
         state['intent'] = intent
-        print(f"   Intención detectada: {intent}")
+        state['intent_confidence'] = confidence
+        state['intent_source'] = source
+        tracer.annotate(intent=intent, intent_source=source, confidence=round(confidence, 2))
         
         return state
     
+    async def _classify_with_llm(self, user_message: str) -> str:
+        """Desempata mensajes ambiguos con el LLM; devuelve '' si la respuesta no es válida"""
+        labels = ('general',) + ROUTABLE_INTENTS
+        prompt = (
+            "Clasifica la intención del mensaje de un cliente de una inmobiliaria. "
+            "Responde únicamente con una de estas etiquetas: " + ", ".join(labels) + ".\n"
+            "lead_capture: comparte o pide datos de contacto. "
+            "appointment: quiere agendar una cita o visita. "
+            "general: cualquier otra consulta."
+        )
+        try:
+            response = await self.llm.ainvoke([
+                SystemMessage(content=prompt),
+                HumanMessage(content=user_message)
+            ])
+        except Exception as e:
+            logger.warning("Error clasificando con LLM", session_id=self.session_data.get('id'), error=str(e))
+            return ''
+        
+        label = response.content.strip().lower()
+        return label if label in labels else ''
+    
     async def general_response_node(self, state: Dict) -> Dict:
         """Genera respuesta general sobre la inmobiliaria"""
-        print("💬 General Response - Generando respuesta general")
+        window = state['context_window']
+        context_metadata = {'history_messages': len(window.messages), 'context_tokens': window.tokens}
         
-        context = state['context']
-        system_prompt = f"""Eres un asistente de IA para {context['business_name']} ubicada en {context['location']}.
-
-Información de la empresa:
-- Nombre: {context['business_name']}
-- Ubicación: {context['location']}
-- Tipos de propiedades: {context['property_types']}
-- Horarios: {context['working_hours']}
-- Teléfono: {context['phone']}
-{f"- Sitio web: {context['website']}" if context['website'] else ''}
-
-Responde de manera amable y profesional. Si no tienes información específica sobre propiedades, deriva al usuario a contactar directamente."""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": state['user_message']}
-        ]
+        # Mismo prompt + mismo contexto + misma pregunta (normalizada) => misma respuesta.
+        # La respuesta puede depender de la conversación, así que el contexto va en la clave
+        session_id = self.session_data.get('id', '')
+        prompt_hash = self.system_prompt_hash
+        context_hash = window.digest
+        lookup_start = time.perf_counter()
+        cached = response_cache.get(session_id, prompt_hash, state['user_message'], context_hash)
+        
+        tracer.annotate(cache_hit=cached is not None, **context_metadata)
         
-        response = await self.llm.ainvoke([
-            AIMessage(content=system_prompt),
-            HumanMessage(content=state['user_message'])
-        ])
+        if cached is not None:
+            state['response'] = cached.response
+            state['response_type'] = 'general'
+            state['metadata'] = {'cache': {
+                'hit': True,
+                'saved_tokens': cached.tokens,
+                'saved_latency_ms': round(cached.llm_latency_ms, 1),
+                'latency_ms': round((time.perf_counter() - lookup_start) * 1000, 2),
+                'hit_rate': response_cache.hit_rate()
+            }, 'context': context_metadata}
+            return state
+        
+        llm_start = time.perf_counter()
+        response = await self.llm.ainvoke(build_messages(
+            self.system_prompt, window.messages, HumanMessage(content=state['user_message'])
+        ))
+        llm_latency_ms = (time.perf_counter() - llm_start) * 1000
+        tokens = _total_tokens(response)
+        prompt_usage = cache_usage(response)
+        
+        response_cache.put(session_id, prompt_hash, state['user_message'], response.content,
+                           tokens=tokens, llm_latency_ms=llm_latency_ms, context_hash=context_hash)
         
         state['response'] = response.content
         state['response_type'] = 'general'
+        state['metadata'] = {'cache': {
+            'hit': False,
+            'tokens': tokens,
+            'latency_ms': round(llm_latency_ms, 1),
+            'hit_rate': response_cache.hit_rate()
+        }, 'context': context_metadata, 'prompt_cache': {
+            'prompt_hash': prompt_hash[:12],
+            'input_tokens': prompt_usage['input_tokens'],
+            'cached_input_tokens': prompt_usage['cached_input_tokens'],
+            'uncached_input_tokens': prompt_usage['uncached_input_tokens']
+        }}
         
         return state
     
     async def lead_capture_node(self, state: Dict) -> Dict:
         """Maneja la captura de leads"""
-        print("👤 Lead Capture - Procesando información de lead")
-        
         context = state['context']
         response = f"""¡Perfecto! Me da mucho gusto poder ayudarte. Soy el asistente de {context['business_name']}.
 
@@ -174,7 +268,7 @@ Para poder darte la mejor información sobre {context['property_types']} en {con
 - ¿Cuál es tu presupuesto aproximado?
 
 Puedes contactarnos directamente al {context['phone']} o durante nuestros horarios: {context['working_hours']}"""
-        
+
         state['response'] = response
         state['response_type'] = 'lead_capture'
         state['metadata'] = {'lead_info_requested': True}
@@ -183,8 +277,6 @@ Puedes contactarnos directamente al {context['phone']} o durante nuestros horari
     
     async def appointment_scheduler_node(self, state: Dict) -> Dict:
         """Maneja el agendamiento de citas"""
-        print("📅 Appointment Scheduler - Gestionando cita")
-        
         context = state['context']
         response = f"""¡Excelente! Me encanta que quieras conocer nuestras propiedades en persona.
 
@@ -197,7 +289,7 @@ Para agendar tu visita a {context['business_name']}:
 Nuestro equipo te contactará para coordinar el mejor horario y preparar una selección personalizada de {context['property_types']} que se ajusten a lo que buscas.
 
 ¿Hay algún día y horario que te convenga más?"""
-        
+
         state['response'] = response
         state['response_type'] = 'appointment'
         state['metadata'] = {'appointment_requested': True}
@@ -206,8 +298,6 @@ Nuestro equipo te contactará para coordinar el mejor horario y preparar una sel
     
     async def finalizer_node(self, state: Dict) -> Dict:
         """Nodo final que prepara la respuesta"""
-        print("✅ Finalizer - Preparando respuesta final")
-        
         # Agregar información adicional si es necesario
         if not state.get('response'):
             state['response'] = "Lo siento, no pude procesar tu consulta. ¿Podrías reformularla?"
@@ -217,22 +307,75 @@ Nuestro equipo te contactará para coordinar el mejor horario y preparar una sel
         
         return state
     
-    def route_conversation(self, state: Dict) -> str:
+    @staticmethod
+    def route_conversation(state: Dict) -> str:
         """Enruta la conversación según la intención"""
         return state.get('intent', 'general')
     
-    async def process_message(self, user_message: str, conversation_history: List[Dict] = None) -> Dict:
-        """Procesa un mensaje del usuario usando LangGraph"""
-        initial_state = {
+    def _initial_state(self, user_message: str, conversation_history: List[Dict] = None,
+                       conversation_summary: str = "") -> Dict:
+        return {
             'user_message': user_message,
-            'conversation_history': conversation_history or []
+            'conversation_history': conversation_history or [],
+            'conversation_summary': conversation_summary or ""
         }
-        
-        result = await self.graph.ainvoke(initial_state)
-        
+    
+    @staticmethod
+    def _build_result(result: Dict) -> Dict:
         return {
             'response': result.get('response', ''),
             'response_type': result.get('response_type', 'general'),
             'metadata': result.get('metadata', {}),
-            'intent': result.get('intent', 'general')
+            'intent': result.get('intent', 'general'),
+            'summary_delta': result.get('summary_delta', [])
         }
+    
+    async def process_message(self, user_message: str, conversation_history: List[Dict] = None,
+                              conversation_summary: str = "") -> Dict:
+        """Procesa un mensaje del usuario usando LangGraph"""
+        initial_state = self._initial_state(user_message, conversation_history, conversation_summary)
+        
+        result = await self.get_graph().ainvoke(
+            initial_state,
+            config={"configurable": {"agent": self}}
+        )
+        
+        return self._build_result(result)
+    
+    async def stream_message(self, user_message: str, conversation_history: List[Dict] = None,
+                             conversation_summary: str = ""):
+        """Ejecuta el mismo flujo de LangGraph emitiendo los tokens del LLM a medida que llegan.
+        
+        Produce eventos {'type': 'token', 'content': str} y, al terminar,
+        un único {'type': 'result', 'result': Dict} con el mismo formato que process_message.
+        """
+        initial_state = self._initial_state(user_message, conversation_history, conversation_summary)
+        streamed = False
+        final_state = None
+        
+        async for event in self.get_graph().astream_events(
+            initial_state,
+            config={"configurable": {"agent": self}},
+            version="v2"
+        ):
+            kind = event["event"]
+            
+            if kind == "on_chat_model_stream":
+                # Solo los tokens de la respuesta al usuario, no llamadas auxiliares
+                if event.get("metadata", {}).get("langgraph_node") != "general_response":
+                    continue
+                content = event["data"]["chunk"].content
+                if isinstance(content, str) and content:
+                    streamed = True
+                    yield {'type': 'token', 'content': content}
+            
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                final_state = event["data"].get("output")
+        
+        result = self._build_result(final_state or {})
+        
+        # Las respuestas con plantilla no pasan por el LLM: se envían en un solo bloque
+        if not streamed and result['response']:
+            yield {'type': 'token', 'content': result['response']}
+        
+        yield {'type': 'result', 'result': result}
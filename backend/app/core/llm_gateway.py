@@ -0,0 +1,435 @@
+"""Gateway de llamadas al LLM compartido por todo el proceso.
+
+- Límites por proveedor: semáforo de concurrencia + token bucket de peticiones
+  por minuto, para no superar los rate limits ni acumular peticiones sin tope
+  cuando un proveedor se degrada.
+- Single-flight: prompts idénticos en vuelo comparten una sola llamada.
+- Timeout por llamada y fallback ordenado entre proveedores (los de ApiProvider):
+  si el proveedor falla, expira o su p95 reciente supera el umbral, se prueba
+  el siguiente disponible.
+- Proveedor `stub` local y determinista para pruebas (ver stub_llm.py).
+- Marcas de caché de prefijo específicas de cada proveedor (prompts.py) y
+  tokens de entrada cacheados / no cacheados por llamada.
+- El SDK de cada proveedor se importa la primera vez que se usa (o en el
+  warm-up del arranque), no al importar este módulo.
+"""
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import time
+from app.core.import_report import timed_import
+from app.core.metrics import Histogram, Counter, registry
+from app.core.prompts import PROMPT_CACHE, ANTHROPIC_CACHE_HEADER, apply_cache_markers, cache_usage
+from app.core.tracing import tracer
+
+# Modelo por defecto de cada proveedor
+DEFAULT_MODELS = {
+    'openai': "gpt-4",
+    'anthropic': "claude-3-sonnet-20240229",
+    'openrouter': os.getenv("OPENROUTER_MODEL", "openai/gpt-4"),
+    'google': os.getenv("GOOGLE_MODEL", "gemini-1.5-pro"),
+    'stub': "stub"
+}
+
+API_KEY_ENV = {
+    'openai': "OPENAI_API_KEY",
+    'anthropic': "ANTHROPIC_API_KEY",
+    'openrouter': "OPENROUTER_API_KEY",
+    'google': "GOOGLE_API_KEY"
+}
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# (módulo, clase) del cliente de cada proveedor; se importan bajo demanda
+PROVIDER_CLIENTS = {
+    'openai': ("langchain_openai", "ChatOpenAI"),
+    'openrouter': ("langchain_openai", "ChatOpenAI"),
+    'anthropic': ("langchain_anthropic", "ChatAnthropic"),
+    'google': ("langchain_google_genai", "ChatGoogleGenerativeAI"),
+    'stub': ("app.core.stub_llm", "StubChatModel")
+}
+
+# (concurrencia máxima, peticiones por minuto) por defecto; 0 rpm = sin límite.
+# Se ajustan con LLM_<PROVEEDOR>_MAX_CONCURRENCY y LLM_<PROVEEDOR>_RPM
+DEFAULT_LIMITS = {
+    'openai': (16, 500),
+    'anthropic': (8, 50),
+    'openrouter': (16, 200),
+    'google': (8, 60),
+    'stub': (256, 0)
+}
+
+# Fuerza un proveedor para todas las sesiones (p. ej. 'stub' en pruebas y benchmarks)
+LLM_PROVIDER_OVERRIDE = os.getenv("LLM_PROVIDER_OVERRIDE", "").strip().lower()
+
+class LLMUnavailableError(RuntimeError):
+    """Ningún proveedor de la cadena pudo responder"""
+    pass
+
+def provider_available(api_provider: str) -> bool:
+    """True si el proveedor está configurado (API key y, para google, su paquete)"""
+    if api_provider == 'stub':
+        return True
+    if api_provider not in API_KEY_ENV or not os.getenv(API_KEY_ENV[api_provider]):
+        return False
+    if api_provider == 'google':
+        # Comprobar que el paquete está instalado sin llegar a importarlo
+        return importlib.util.find_spec(PROVIDER_CLIENTS['google'][0]) is not None
+    return True
+
+def configured_providers() -> List[str]:
+    """Proveedores que este proceso puede llegar a usar (los que se precargan en el warm-up)"""
+    if LLM_PROVIDER_OVERRIDE:
+        return [LLM_PROVIDER_OVERRIDE]
+    return [p for p in API_KEY_ENV if provider_available(p)]
+
+def _client_class(api_provider: str):
+    module_name, class_name = PROVIDER_CLIENTS.get(api_provider, PROVIDER_CLIENTS['openai'])
+    return getattr(timed_import(module_name), class_name)
+
+def create_llm(api_provider: str, model: str, temperature: float):
+    """Crea un cliente LLM nuevo (con su propio pool de conexiones HTTP)"""
+    client_class = _client_class(api_provider)
+    
+    if api_provider == 'stub':
+        return client_class(
+            latency_ms=float(os.getenv("STUB_LLM_LATENCY_MS", "50")),
+            chunk_ms=float(os.getenv("STUB_LLM_CHUNK_MS", "5")),
+            cache_min_tokens=int(os.getenv("STUB_LLM_CACHE_MIN_TOKENS", "1024"))
+        )
+    
+    if api_provider == 'anthropic':
+        return client_class(
+            model=model,
+            temperature=temperature,
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            default_headers=ANTHROPIC_CACHE_HEADER if PROMPT_CACHE else None
+        )
+    
+    if api_provider == 'openrouter':
+        # API compatible con OpenAI
+        return client_class(
+            model=model,
+            temperature=temperature,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            base_url=OPENROUTER_BASE_URL
+        )
+    
+    if api_provider == 'google':
+        return client_class(
+            model=model,
+            temperature=temperature,
+            google_api_key=os.getenv("GOOGLE_API_KEY")
+        )
+    
+    return client_class(
+        model=model,
+        temperature=temperature,
+        api_key=os.getenv("OPENAI_API_KEY")
+    )
+
+class TokenBucket:
+    """Limita a `per_minute` peticiones por minuto con ráfagas de hasta un segundo de cupo"""
+    
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ProviderLimiter:
+    """Semáforo, token bucket y latencias recientes de un proveedor"""
+    
+    def __init__(self, name: str, max_concurrency: int, requests_per_minute: float,
+                 window: int = 200):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.latencies: deque = deque(maxlen=window)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+    
+    def observe(self, seconds: float):
+        self.latencies.append(seconds)
+    
+    def p95(self, min_samples: int = 1) -> Optional[float]:
+        """p95 de las últimas llamadas; None si aún no hay muestras suficientes"""
+        if len(self.latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[math.ceil(0.95 * len(ordered)) - 1]
+    
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "p95_seconds": round(p95, 3) if p95 is not None else None
+        }
+
+class _Flight:
+    """Llamada en vuelo compartida por todas las peticiones con el mismo prompt"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class GatewayLLM:
+    """Cliente ligado a (proveedor, modelo, temperatura) con la interfaz `ainvoke` de un chat model.
+    
+    Es lo que reciben los agentes: todas sus llamadas pasan por el gateway.
+    """
+    
+    def __init__(self, gateway: "LLMGateway", api_provider: str, model: str, temperature: float):
+        self.gateway = gateway
+        self.api_provider = api_provider
+        self.model = model
+        self.temperature = temperature
+    
+    async def ainvoke(self, messages: List[Any], **kwargs):
+        return await self.gateway.ainvoke(self.api_provider, self.model, self.temperature, messages, **kwargs)
+
+class LLMGateway:
+    """Punto único por el que pasan todas las llamadas al LLM del proceso"""
+    
+    def __init__(self, timeout: float = 30.0, queue_timeout: float = 5.0, p95_threshold: float = 10.0,
+                 min_samples: int = 20, fallback_providers: Tuple[str, ...] = (), coalesce: bool = True):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.p95_threshold = p95_threshold
+        self.min_samples = min_samples
+        self.fallback_providers = fallback_providers
+        self.coalesce = coalesce
+        self._clients: Dict[Tuple[str, str, float], Any] = {}
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self.latency = Histogram("llm_request_seconds", "Latencia de las llamadas al LLM por proveedor")
+        self.tokens = Counter("llm_tokens_total", "Tokens consumidos por proveedor y tipo")
+        self.in_flight = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+    
+    def client(self, api_provider: str, model: str, temperature: float):
+        """Cliente compartido por (proveedor, modelo, temperatura): conexiones HTTP/TLS calientes"""
+        key = (api_provider, model, temperature)
+        llm = self._clients.get(key)
+        if llm is None:
+            llm = create_llm(api_provider, model, temperature)
+            self._clients[key] = llm
+        return llm
+    
+    def bind(self, api_provider: str, model: str, temperature: float) -> GatewayLLM:
+        return GatewayLLM(self, api_provider, model, temperature)
+    
+    def limiter(self, api_provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(api_provider)
+        if limiter is None:
+            concurrency, rpm = DEFAULT_LIMITS.get(api_provider, DEFAULT_LIMITS['openai'])
+            prefix = f"LLM_{api_provider.upper()}"
+            limiter = ProviderLimiter(
+                api_provider,
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(concurrency))),
+                requests_per_minute=float(os.getenv(f"{prefix}_RPM", str(rpm)))
+            )
+            self._limiters[api_provider] = limiter
+        return limiter
+    
+    def _is_slow(self, api_provider: str) -> bool:
+        p95 = self.limiter(api_provider).p95(self.min_samples)
+        return p95 is not None and p95 > self.p95_threshold
+    
+    def route(self, api_provider: str) -> List[str]:
+        """Orden en que se prueban los proveedores: el de la sesión y luego los de respaldo.
+        
+        Si el p95 reciente de un proveedor supera el umbral, pasa detrás de los
+        que están sanos (sigue en la cadena como último recurso).
+        """
+        chain = [api_provider] + [
+            p for p in self.fallback_providers if p != api_provider and provider_available(p)
+        ]
+        # sorted es estable: entre sanos se respeta el orden configurado
+        return sorted(chain, key=self._is_slow)
+    
+    @staticmethod
+    def _flight_key(api_provider: str, model: str, temperature: float, messages: List[Any]) -> str:
+        payload = json.dumps(
+            [api_provider, model, temperature, [(m.type, m.content) for m in messages]],
+            ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    async def ainvoke(self, api_provider: str, model: str, temperature: float, messages: List[Any], **kwargs):
+        """Invoca el LLM respetando límites, coalescencia, timeout y fallback"""
+        self.in_flight += 1
+        try:
+            if not self.coalesce or kwargs:
+                return await self._invoke_chain(api_provider, model, temperature, messages, **kwargs)
+            
+            key = self._flight_key(api_provider, model, temperature, messages)
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(asyncio.ensure_future(
+                    self._invoke_chain(api_provider, model, temperature, messages)
+                ))
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._forget_flight(key, flight))
+            else:
+                self.coalesced += 1
+            
+            flight.waiters += 1
+            try:
+                return await asyncio.shield(flight.task)
+            finally:
+                flight.waiters -= 1
+                # Si todos los interesados se fueron (p. ej. cliente desconectado), cancelar
+                if flight.waiters == 0 and not flight.task.done():
+                    flight.task.cancel()
+        finally:
+            self.in_flight -= 1
+    
+    def warm_up(self, providers: List[str], temperature: float) -> Dict[str, float]:
+        """Importa el SDK y crea el cliente por defecto de cada proveedor; devuelve ms por proveedor"""
+        timings = {}
+        for api_provider in providers:
+            if api_provider not in DEFAULT_MODELS:
+                continue
+            start = time.perf_counter()
+            self.client(api_provider, DEFAULT_MODELS[api_provider], temperature)
+            timings[api_provider] = round((time.perf_counter() - start) * 1000, 1)
+        return timings
+    
+    async def drain(self, timeout: float) -> bool:
+        """Espera a que terminen las llamadas en curso (apagado ordenado); False si se agota el plazo"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.in_flight
+    
+    def _forget_flight(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    async def _invoke_chain(self, api_provider: str, model: str, temperature: float,
+                            messages: List[Any], **kwargs):
+        errors = []
+        for index, candidate in enumerate(self.route(api_provider)):
+            candidate_model = model if candidate == api_provider else DEFAULT_MODELS[candidate]
+            if index:
+                self.fallbacks += 1
+            try:
+                return await self._invoke_provider(candidate, candidate_model, temperature, messages, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors.append(f"{candidate}: {type(e).__name__}: {e}")
+        
+        raise LLMUnavailableError("Ningún proveedor LLM respondió (" + "; ".join(errors) + ")")
+    
+    async def _invoke_provider(self, api_provider: str, model: str, temperature: float,
+                               messages: List[Any], **kwargs):
+        limiter = self.limiter(api_provider)
+        
+        # Cola acotada: si el proveedor está saturado, mejor pasar al siguiente
+        try:
+            await asyncio.wait_for(limiter.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            limiter.rejected += 1
+            raise TimeoutError(f"sin cupo de concurrencia tras {self.queue_timeout}s")
+        
+        limiter.in_flight += 1
+        try:
+            if limiter.bucket is not None:
+                await limiter.bucket.acquire()
+            
+            limiter.requests += 1
+            messages = apply_cache_markers(api_provider, messages)
+            with tracer.span("llm.call", provider=api_provider, model=model) as span:
+                start = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        self.client(api_provider, model, temperature).ainvoke(messages, **kwargs),
+                        timeout=self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    limiter.timeouts += 1
+                    limiter.observe(self.timeout)
+                    raise TimeoutError(f"sin respuesta tras {self.timeout}s")
+                except Exception:
+                    limiter.errors += 1
+                    raise
+                
+                elapsed = time.perf_counter() - start
+                limiter.observe(elapsed)
+                self.latency.observe(elapsed, provider=api_provider)
+                self._count_tokens(api_provider, response, span)
+                return response
+        finally:
+            limiter.in_flight -= 1
+            limiter.semaphore.release()
+    
+    def _count_tokens(self, api_provider: str, response, span):
+        usage = getattr(response, 'usage_metadata', None) or {}
+        prompt = cache_usage(response)
+        input_tokens = prompt['input_tokens']
+        output_tokens = usage.get('output_tokens', 0)
+        span.set(input_tokens=input_tokens, output_tokens=output_tokens,
+                 cached_input_tokens=prompt['cached_input_tokens'],
+                 uncached_input_tokens=prompt['uncached_input_tokens'],
+                 total_tokens=input_tokens + output_tokens)
+        if input_tokens:
+            self.tokens.inc(input_tokens, provider=api_provider, kind="input")
+        if prompt['cached_input_tokens']:
+            self.tokens.inc(prompt['cached_input_tokens'], provider=api_provider, kind="input_cached")
+        if prompt['cache_write_tokens']:
+            self.tokens.inc(prompt['cache_write_tokens'], provider=api_provider, kind="input_cache_write")
+        if output_tokens:
+            self.tokens.inc(output_tokens, provider=api_provider, kind="output")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "coalesced": self.coalesced,
+            "fallbacks": self.fallbacks,
+            "clients": len(self._clients),
+            "providers": {name: limiter.stats() for name, limiter in self._limiters.items()},
+            "latency_seconds": self.latency.snapshot()
+        }
+
+# Instancia global del gateway
+llm_gateway = LLMGateway(
+    timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "5")),
+    p95_threshold=float(os.getenv("LLM_P95_THRESHOLD", "10")),
+    min_samples=int(os.getenv("LLM_P95_MIN_SAMPLES", "20")),
+    fallback_providers=tuple(
+        p.strip().lower() for p in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",") if p.strip()
+    ),
+    coalesce=os.getenv("LLM_COALESCE", "true").lower() in ("1", "true", "yes")
+)
+
+registry.gauge("llm_in_flight", "Llamadas al LLM en curso", lambda: llm_gateway.in_flight)
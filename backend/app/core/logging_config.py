@@ -0,0 +1,140 @@
+"""Logging del proceso sin bloquear el event loop.
+
+Todos los logs (structlog de la app, trazas y los loggers de uvicorn) van a un
+QueueHandler acotado; un hilo (QueueListener) los formatea como JSON y los
+escribe a stdout. Si la cola se llena, el registro se descarta y se cuenta:
+nunca se espera por stdout dentro de una petición.
+
+Los niveles se filtran antes de construir el evento (LOG_LEVEL): un
+`logger.debug(...)` en el camino caliente no cuesta nada con INFO.
+
+Uso en los módulos:
+
+    from app.core.logging_config import get_logger
+    logger = get_logger(__name__)
+    logger.error("Error en chat", session_id=session_id, exc_info=True)
+"""
+from typing import Dict, Any, Optional
+from datetime import datetime
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import structlog
+from app.core.metrics import registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# json (producción) o console (desarrollo local)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Log de acceso de uvicorn (una línea por petición); las trazas ya cubren cada petición
+LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() in ("1", "true", "yes")
+
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear con la cola llena"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # El formateo se hace en el hilo del listener, no en el event loop
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _capture_exc_info(logger, method_name, event_dict):
+    """exc_info=True se resuelve aquí: en el hilo del listener ya no hay excepción activa"""
+    if event_dict.get("exc_info") is True or method_name == "exception":
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+def _add_timestamp(logger, method_name, event_dict):
+    """Hora de emisión del registro (no la de escritura, que va diferida)"""
+    record = event_dict.get("_record")
+    created = datetime.fromtimestamp(record.created) if record is not None else datetime.now()
+    event_dict["timestamp"] = created.isoformat()
+    return event_dict
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def get_logger(name: str):
+    return structlog.get_logger(name)
+
+def configure_logging():
+    """Instala el pipeline (llamar al arrancar, antes de emitir logs)"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    
+    level = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(level, int):
+        level = logging.INFO
+    
+    structlog.configure(
+        processors=[_capture_exc_info, structlog.stdlib.ProcessorFormatter.wrap_for_formatter],
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        cache_logger_on_first_use=True
+    )
+    
+    renderer = (
+        structlog.dev.ConsoleRenderer(colors=False) if LOG_FORMAT == "console"
+        else structlog.processors.JSONRenderer(ensure_ascii=False, default=str)
+    )
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.stdlib.add_log_level,
+            structlog.stdlib.add_logger_name,
+            _add_timestamp,
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.format_exc_info,
+            renderer
+        ]
+    ))
+    
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    
+    # uvicorn instala sus propios handlers síncronos: se redirigen a la cola
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    if not LOG_ACCESS:
+        logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+def shutdown_logging():
+    """Escribe lo que quede en la cola y detiene el hilo del listener"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+def logging_stats() -> Dict[str, Any]:
+    return {
+        "level": LOG_LEVEL,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0
+    }
+
+registry.gauge("log_queue_records", "Registros de log pendientes de escribir", lambda: logging_stats()["queued"])
+registry.gauge("log_records_dropped", "Registros de log descartados por cola llena", lambda: logging_stats()["dropped"])
@@ -0,0 +1,141 @@
+from typing import Dict, Any, Tuple, Callable, List, Optional
+import bisect
+
+# Límites por defecto (segundos), pensados para latencias de base de datos y LLM
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for key, value in sorted(labels.items())
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class MetricsRegistry:
+    """Métricas del proceso, expuestas en formato de texto de Prometheus en /metrics"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Any]]] = {}
+    
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def gauge(self, name: str, description: str, read: Callable[[], Any]):
+        """Gauge leído en cada scrape; `read` devuelve un número o {etiqueta: número}"""
+        self._gauges[name] = (description, read)
+    
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        
+        for name, (description, read) in self._gauges.items():
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, item in value.items():
+                    lines.append(f"{name}{_format_labels(dict(labels))} {item}")
+            elif value is not None:
+                lines.append(f"{name} {value}")
+        
+        return "\n".join(lines) + "\n"
+
+# Registro global del proceso
+registry = MetricsRegistry()
+
+class Counter:
+    """Contador monótono con series por etiquetas"""
+    
+    def __init__(self, name: str, description: str, metrics_registry: Optional[MetricsRegistry] = registry):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple, float] = {}
+        if metrics_registry is not None:
+            metrics_registry.register(self)
+    
+    def inc(self, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + value
+    
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(key))} {value}")
+        return lines
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus, con series por etiquetas"""
+    
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 metrics_registry: Optional[MetricsRegistry] = registry):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, Dict[str, Any]] = {}
+        if metrics_registry is not None:
+            metrics_registry.register(self)
+    
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            self._series[key] = series
+        
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+    
+    def quantile(self, q: float, **labels: str) -> float:
+        """Cuantil aproximado (límite superior del bucket que lo contiene)"""
+        series = self._series.get(tuple(sorted(labels.items())))
+        if not series or not series["count"]:
+            return 0.0
+        
+        target = q * series["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+    
+    def snapshot(self) -> list:
+        """Series con buckets acumulados, sum y count"""
+        result = []
+        for key, series in self._series.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = series["count"]
+            
+            result.append({
+                "labels": dict(key),
+                "buckets": buckets,
+                "sum": round(series["sum"], 6),
+                "count": series["count"]
+            })
+        return result
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for series in self.snapshot():
+            labels = series["labels"]
+            for bound, cumulative in series["buckets"].items():
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
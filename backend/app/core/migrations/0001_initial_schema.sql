@@ -0,0 +1,47 @@
+-- Esquema inicial (idéntico al que creaba Database.create_tables, idempotente
+-- para bases de datos ya existentes)
+
+-- Tabla de sesiones
+CREATE TABLE IF NOT EXISTS sessions (
+    id VARCHAR(50) PRIMARY KEY,
+    business_name VARCHAR(200) NOT NULL,
+    website VARCHAR(500),
+    location VARCHAR(100) NOT NULL,
+    property_types VARCHAR(200) NOT NULL,
+    working_hours VARCHAR(100) NOT NULL,
+    phone VARCHAR(20) NOT NULL,
+    api_provider VARCHAR(20) NOT NULL DEFAULT 'openai',
+    system_prompt TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tabla de mensajes/conversaciones
+CREATE TABLE IF NOT EXISTS messages (
+    id SERIAL PRIMARY KEY,
+    session_id VARCHAR(50) REFERENCES sessions(id),
+    content TEXT NOT NULL,
+    sender VARCHAR(10) NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    metadata JSONB
+);
+
+-- Tabla de configuraciones de agente
+CREATE TABLE IF NOT EXISTS agent_configs (
+    session_id VARCHAR(50) PRIMARY KEY REFERENCES sessions(id),
+    voice_provider VARCHAR(20) DEFAULT 'retell',
+    voice_id VARCHAR(50) DEFAULT 'default-voice',
+    plan VARCHAR(10) DEFAULT 'starter',
+    max_tokens INTEGER DEFAULT 1000,
+    temperature DECIMAL(3,2) DEFAULT 0.7,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tabla de estadísticas
+CREATE TABLE IF NOT EXISTS stats (
+    session_id VARCHAR(50) PRIMARY KEY REFERENCES sessions(id),
+    total_calls INTEGER DEFAULT 0,
+    total_minutes INTEGER DEFAULT 0,
+    leads INTEGER DEFAULT 0,
+    scheduled_visits INTEGER DEFAULT 0,
+    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
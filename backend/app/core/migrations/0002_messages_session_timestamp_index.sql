@@ -0,0 +1,8 @@
+-- migrate:no-transaction
+-- Índice para historial y paginación por keyset: (session_id, timestamp, id).
+-- CONCURRENTLY no bloquea las escrituras en messages mientras se construye. Si una
+-- ejecución anterior falló a medias, el índice quedó INVALID: se elimina y se rehace
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_session_timestamp;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_session_timestamp
+    ON messages (session_id, timestamp, id);
@@ -0,0 +1,2 @@
+-- Diccionario de intenciones por sesión: {"lead_capture": [...], "appointment": [...]}
+ALTER TABLE agent_configs ADD COLUMN IF NOT EXISTS intent_keywords JSONB;
@@ -0,0 +1,7 @@
+-- Resumen incremental por sesión: cubre todos los mensajes con id <= summarized_until_id
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_id VARCHAR(50) PRIMARY KEY REFERENCES sessions(id),
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_until_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
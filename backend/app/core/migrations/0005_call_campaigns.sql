@@ -0,0 +1,33 @@
+-- Campañas de llamadas masivas y el resultado de cada llamada
+CREATE TABLE IF NOT EXISTS call_campaigns (
+    id VARCHAR(50) PRIMARY KEY,
+    session_id VARCHAR(50) NOT NULL REFERENCES sessions(id),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    total_calls INTEGER NOT NULL,
+    completed_calls INTEGER NOT NULL DEFAULT 0,
+    failed_calls INTEGER NOT NULL DEFAULT 0,
+    total_minutes INTEGER NOT NULL DEFAULT 0,
+    concurrency INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_campaigns_session
+    ON call_campaigns (session_id, created_at);
+
+-- Se escribe por lotes con COPY (copy_records_to_table)
+CREATE TABLE IF NOT EXISTS campaign_calls (
+    id BIGSERIAL PRIMARY KEY,
+    campaign_id VARCHAR(50) NOT NULL REFERENCES call_campaigns(id),
+    session_id VARCHAR(50) NOT NULL,
+    phone_number VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    duration_minutes INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_campaign_calls_campaign
+    ON campaign_calls (campaign_id, id);
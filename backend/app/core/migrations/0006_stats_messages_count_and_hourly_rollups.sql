@@ -0,0 +1,31 @@
+-- Contador de mensajes mantenido por el agregador de stats (sustituye el COUNT(*) del dashboard)
+ALTER TABLE stats ADD COLUMN IF NOT EXISTS messages_count INTEGER NOT NULL DEFAULT 0;
+
+-- Toda sesión tiene su fila de stats (antes el GET del dashboard la creaba si faltaba)
+INSERT INTO stats (session_id)
+SELECT s.id FROM sessions s
+WHERE NOT EXISTS (SELECT 1 FROM stats st WHERE st.session_id = s.id);
+
+UPDATE stats AS st SET messages_count = m.total
+FROM (SELECT session_id, COUNT(*) AS total FROM messages GROUP BY session_id) AS m
+WHERE st.session_id = m.session_id;
+
+-- Acumulados por sesión y hora
+CREATE TABLE IF NOT EXISTS stats_hourly (
+    session_id VARCHAR(50) NOT NULL REFERENCES sessions(id),
+    bucket TIMESTAMP NOT NULL,
+    total_calls INTEGER NOT NULL DEFAULT 0,
+    total_minutes INTEGER NOT NULL DEFAULT 0,
+    leads INTEGER NOT NULL DEFAULT 0,
+    scheduled_visits INTEGER NOT NULL DEFAULT 0,
+    messages_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, bucket)
+);
+
+-- Los mensajes históricos tienen marca de tiempo; el resto de contadores empieza desde ahora
+INSERT INTO stats_hourly (session_id, bucket, messages_count)
+SELECT session_id, date_trunc('hour', timestamp), COUNT(*)
+FROM messages
+WHERE session_id IS NOT NULL AND timestamp IS NOT NULL
+GROUP BY session_id, date_trunc('hour', timestamp)
+ON CONFLICT (session_id, bucket) DO NOTHING;
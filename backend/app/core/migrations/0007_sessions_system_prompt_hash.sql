@@ -0,0 +1,5 @@
+-- Hash del prompt de sistema canónico (caché de prefijos del proveedor y caché de respuestas)
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS system_prompt_hash VARCHAR(64);
+
+UPDATE sessions SET system_prompt_hash = encode(sha256(convert_to(system_prompt, 'UTF8')), 'hex')
+WHERE system_prompt IS NOT NULL AND system_prompt_hash IS NULL;
@@ -0,0 +1,104 @@
+-- messages pasa a estar particionada por mes (RANGE sobre timestamp). Las
+-- particiones frías se archivan en Parquet y se eliminan (message_archive.py),
+-- así el tamaño de la tabla caliente, sus índices y el vacuum no crecen con el
+-- historial. Las particiones futuras las crea ensure_message_partitions.
+--
+-- Requiere una ventana de mantenimiento: copia todo `messages` en una sola
+-- transacción y el RENAME deja la tabla bajo ACCESS EXCLUSIVE hasta el final,
+-- así que lecturas y escrituras de mensajes esperan mientras dura la copia
+-- (proporcional al tamaño de la tabla). Aplicarla con la API parada:
+-- python -m app.core.migrate (ver README, "Historial de mensajes y archivo").
+
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey;
+ALTER INDEX IF EXISTS idx_messages_session_timestamp RENAME TO idx_messages_legacy_session_timestamp;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    session_id VARCHAR(50) NOT NULL REFERENCES sessions(id),
+    content TEXT NOT NULL,
+    sender VARCHAR(10) NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    metadata JSONB,
+    -- Debe incluir las claves de partición (timestamp y session_id si el mes se
+    -- subparticiona por hash); cubre además el historial por keyset
+    PRIMARY KEY (session_id, timestamp, id)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+-- Red de seguridad para filas fuera de las particiones creadas (debería estar vacía)
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+-- Crea las particiones mensuales desde from_month hasta months_ahead meses después
+-- del actual. Con hash_partitions > 0 cada mes nuevo se subparticiona por
+-- HASH(session_id). Devuelve cuántas particiones creó.
+CREATE OR REPLACE FUNCTION ensure_message_partitions(from_month DATE, months_ahead INTEGER,
+                                                     hash_partitions INTEGER DEFAULT 0)
+RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    bucket DATE := date_trunc('month', from_month)::date;
+    last_bucket DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE bucket <= last_bucket LOOP
+        partition_name := 'messages_' || to_char(bucket, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            IF hash_partitions > 0 THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L) PARTITION BY HASH (session_id)',
+                    partition_name, bucket, (bucket + interval '1 month')::date
+                );
+                FOR remainder IN 0 .. hash_partitions - 1 LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                        partition_name || '_h' || remainder, partition_name, hash_partitions, remainder
+                    );
+                END LOOP;
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, bucket, (bucket + interval '1 month')::date
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        bucket := (bucket + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+SELECT ensure_message_partitions(
+    COALESCE((SELECT min(timestamp) FROM messages_legacy), CURRENT_TIMESTAMP)::date, 3
+);
+
+-- Los mensajes sin sesión no son accesibles desde la API y no se copian
+INSERT INTO messages (id, session_id, content, sender, timestamp, metadata)
+SELECT id, session_id, content, sender, COALESCE(timestamp, CURRENT_TIMESTAMP), metadata
+FROM messages_legacy
+WHERE session_id IS NOT NULL;
+
+DROP TABLE messages_legacy;
+
+-- Catálogo de particiones archivadas (un Parquet por mes) y de las sesiones que contienen
+CREATE TABLE IF NOT EXISTS message_archives (
+    id SERIAL PRIMARY KEY,
+    partition_name VARCHAR(63) NOT NULL UNIQUE,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    path TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS message_archive_sessions (
+    session_id VARCHAR(50) NOT NULL REFERENCES sessions(id),
+    archive_id INTEGER NOT NULL REFERENCES message_archives(id),
+    first_timestamp TIMESTAMP NOT NULL,
+    last_timestamp TIMESTAMP NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (session_id, archive_id)
+);
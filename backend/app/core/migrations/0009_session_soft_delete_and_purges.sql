@@ -0,0 +1,23 @@
+-- Borrado de sesiones en dos fases: la sesión se marca (deleted_at) y deja de ser
+-- visible al instante; session_purger.py elimina después sus datos por lotes
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+-- Un trabajo de purga por sesión. Sin FK: sobrevive a la fila de la sesión para
+-- poder consultar su estado. El progreso se confirma con cada lote, así una
+-- purga interrumpida continúa donde se quedó
+CREATE TABLE IF NOT EXISTS session_purges (
+    session_id VARCHAR(50) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    requested_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    completed_at TIMESTAMP,
+    messages_total INTEGER NOT NULL DEFAULT 0,
+    messages_deleted INTEGER NOT NULL DEFAULT 0,
+    calls_deleted INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_purges_pending
+    ON session_purges (requested_at) WHERE completed_at IS NULL;
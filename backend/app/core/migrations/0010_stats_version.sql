@@ -0,0 +1,4 @@
+-- Versión de la fila de stats: cada volcado (y cada corrección) la incrementa en uno y
+-- publica el evento `stats` con la versión resultante. El snapshot del dashboard en
+-- vivo lleva la versión leída, así los eventos ya incluidos en él se descartan
+ALTER TABLE stats ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,84 @@
+-- ensure_message_partitions mueve las filas que ya hubieran caído en
+-- messages_default al crear la partición de su mes. Antes, una sola fila en
+-- DEFAULT impedía crear ese mes (CREATE ... PARTITION OF falla si DEFAULT
+-- contiene filas del rango) y todo el mes seguía acumulándose en DEFAULT.
+-- En ese caso la partición se crea aparte, recibe las filas y se adjunta
+-- (ATTACH valida DEFAULT y clona índices y claves foráneas del padre).
+
+CREATE OR REPLACE FUNCTION ensure_message_partitions(from_month DATE, months_ahead INTEGER,
+                                                     hash_partitions INTEGER DEFAULT 0)
+RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    bucket DATE := date_trunc('month', from_month)::date;
+    last_bucket DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    next_bucket DATE;
+    part_name TEXT;
+    has_default_rows BOOLEAN;
+    moved BIGINT;
+    created INTEGER := 0;
+BEGIN
+    WHILE bucket <= last_bucket LOOP
+        part_name := 'messages_' || to_char(bucket, 'YYYY_MM');
+        next_bucket := (bucket + interval '1 month')::date;
+        -- Los meses ya archivados no se recrean (su nombre está en message_archives)
+        IF to_regclass(part_name) IS NULL
+           AND NOT EXISTS (SELECT 1 FROM message_archives a WHERE a.partition_name = part_name) THEN
+            has_default_rows := EXISTS (
+                SELECT 1 FROM messages_default WHERE timestamp >= bucket AND timestamp < next_bucket
+            );
+            IF hash_partitions > 0 THEN
+                IF has_default_rows THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY HASH (session_id)',
+                        part_name
+                    );
+                ELSE
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L) PARTITION BY HASH (session_id)',
+                        part_name, bucket, next_bucket
+                    );
+                END IF;
+                FOR remainder IN 0 .. hash_partitions - 1 LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                        part_name || '_h' || remainder, part_name, hash_partitions, remainder
+                    );
+                END LOOP;
+            ELSIF has_default_rows THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    part_name
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    part_name, bucket, next_bucket
+                );
+            END IF;
+            
+            IF has_default_rows THEN
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM messages_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                    'INSERT INTO %I (id, session_id, content, sender, timestamp, metadata) '
+                    'SELECT id, session_id, content, sender, timestamp, metadata FROM moved',
+                    bucket, next_bucket, part_name
+                );
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                EXECUTE format(
+                    'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part_name, bucket, next_bucket
+                );
+                RAISE NOTICE 'messages_default: % filas movidas a %', moved, part_name;
+            END IF;
+            created := created + 1;
+        END IF;
+        bucket := next_bucket;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+-- Meses que ya tuvieran filas en DEFAULT (p. ej. si el mantenimiento estuvo parado)
+SELECT ensure_message_partitions(
+    COALESCE((SELECT min(timestamp) FROM messages_default), CURRENT_TIMESTAMP)::date, 3
+);
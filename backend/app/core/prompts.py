@@ -0,0 +1,146 @@
+"""Prompt de sistema de las sesiones y caché de prefijos de los proveedores.
+
+Los proveedores cachean el prefijo de la petición si es idéntico byte a byte
+al de una anterior (OpenAI de forma automática, Anthropic donde se marque con
+`cache_control`). Para aprovecharlo:
+
+- El prompt de cada sesión se renderiza una sola vez al crearla y se guarda en
+  `sessions.system_prompt` junto con su hash (`system_prompt_hash`); el agente
+  lo reutiliza tal cual en cada turno.
+- Los mensajes van siempre en el mismo orden: prompt estático, resumen,
+  historial reciente y mensaje del usuario. Lo que cambia entre turnos queda
+  detrás del prefijo estático.
+- `apply_cache_markers` adapta la lista al proveedor justo antes de llamarlo
+  (en el gateway, así también vale para los proveedores de respaldo).
+- `cache_usage` normaliza los tokens de entrada cacheados que informa cada
+  proveedor.
+
+Los proveedores solo cachean prefijos a partir de un tamaño mínimo (1024
+tokens en OpenAI y en Claude Sonnet): por debajo, la marca no tiene efecto. El
+prompt de sesión ronda los 200 tokens, así que lo que llega a cachearse es el
+prefijo con el historial, que crece turno a turno.
+"""
+from typing import Any, Dict, List, Tuple
+import hashlib
+import os
+from langchain_core.messages import BaseMessage, SystemMessage
+
+PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
+
+# Proveedores que necesitan marcas explícitas (el stub imita a Anthropic)
+MARKED_PROVIDERS = ("anthropic", "stub")
+
+ANTHROPIC_CACHE_HEADER = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+def render_system_prompt(session_data: Dict) -> str:
+    """Prompt canónico de una sesión (solo depende de sus datos de negocio)"""
+    return f"""Eres un asistente de IA para {session_data['business_name']} ubicada en {session_data['location']}.
+
+Información de la empresa:
+- Nombre: {session_data['business_name']}
+- Ubicación: {session_data['location']}
+- Tipos de propiedades: {session_data['property_types']}
+- Horarios: {session_data['working_hours']}
+- Teléfono: {session_data['phone']}
+{f"- Sitio web: {session_data['website']}" if session_data.get('website') else ''}
+
+Tu trabajo es:
+1. Responder consultas sobre propiedades disponibles
+2. Proporcionar información de contacto y horarios
+3. Ser amable y profesional
+4. Capturar información de leads (nombre, teléfono, email, tipo de propiedad buscada)
+5. NO inventar propiedades específicas - deriva a un agente humano para detalles
+
+Siempre mantén un tono profesional pero cercano, y recuerda que representas a {session_data['business_name']}."""
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+def session_prompt(session_data: Dict) -> Tuple[str, str]:
+    """(prompt, hash) guardados en la sesión; las sesiones antiguas sin prompt lo renderizan"""
+    system_prompt = session_data.get('system_prompt') or render_system_prompt(session_data)
+    stored_hash = session_data.get('system_prompt_hash')
+    if stored_hash and session_data.get('system_prompt'):
+        return system_prompt, stored_hash
+    return system_prompt, prompt_hash(system_prompt)
+
+def build_messages(system_prompt: str, context_messages: List[Any], user_message: Any) -> List[Any]:
+    """Orden estable: prefijo estático primero, lo variable al final"""
+    return [SystemMessage(content=system_prompt), *context_messages, user_message]
+
+def _content_blocks(content: Any) -> List[Dict[str, Any]]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return [dict(block) for block in content]
+
+def _with_marker(message: BaseMessage) -> BaseMessage:
+    blocks = _content_blocks(message.content)
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return message.__class__(content=blocks)
+
+def apply_cache_markers(api_provider: str, messages: List[Any]) -> List[Any]:
+    """Lista de mensajes con las marcas de caché que espera el proveedor.
+    
+    Anthropic solo admite un mensaje de sistema al principio: los mensajes de
+    sistema iniciales (prompt y resumen) se funden en uno con varios bloques.
+    Hay dos marcas:
+    
+    - En el prompt estático: compartido por todos los turnos de la sesión
+      (y por sus conversaciones nuevas), pero casi nunca llega al mínimo.
+    - En el último mensaje antes del turno nuevo del usuario: el prefijo con el
+      resumen y el historial, que el turno siguiente repite tal cual. El
+      proveedor busca aciertos hacia atrás desde la marca, así que el turno
+      siguiente lee lo que escribió este.
+    """
+    if not PROMPT_CACHE or api_provider not in MARKED_PROVIDERS:
+        return messages
+    if not messages or not isinstance(messages[0], SystemMessage):
+        return messages
+    
+    leading = 0
+    while leading < len(messages) and isinstance(messages[leading], SystemMessage):
+        leading += 1
+    
+    blocks = _content_blocks(messages[0].content)
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    for message in messages[1:leading]:
+        blocks.extend(_content_blocks(message.content))
+    marked = [SystemMessage(content=blocks), *messages[leading:]]
+    
+    # El último mensaje es el turno nuevo; sin historial, la segunda marca cierra el resumen
+    if len(marked) > 2:
+        marked[-2] = _with_marker(marked[-2])
+    elif leading > 1:
+        blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return marked
+
+def cache_usage(response) -> Dict[str, int]:
+    """Tokens de entrada de una respuesta: totales, leídos de la caché y escritos en ella"""
+    usage = getattr(response, 'usage_metadata', None) or {}
+    input_tokens = usage.get('input_tokens', 0)
+    details = usage.get('input_token_details') or {}
+    
+    if details:
+        # langchain-core >= 0.3: input_tokens ya incluye los cacheados
+        cached = details.get('cache_read') or 0
+        written = details.get('cache_creation') or 0
+    else:
+        metadata = getattr(response, 'response_metadata', None) or {}
+        anthropic_usage = metadata.get('usage') or {}
+        if 'cache_read_input_tokens' in anthropic_usage or 'cache_creation_input_tokens' in anthropic_usage:
+            # Anthropic no cuenta en input_tokens lo leído ni lo escrito en caché
+            cached = anthropic_usage.get('cache_read_input_tokens') or 0
+            written = anthropic_usage.get('cache_creation_input_tokens') or 0
+            input_tokens += cached + written
+        else:
+            token_usage = metadata.get('token_usage') or {}
+            cached = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+            written = 0
+            input_tokens = input_tokens or token_usage.get('prompt_tokens', 0)
+    
+    return {
+        'input_tokens': input_tokens,
+        'cached_input_tokens': cached,
+        'uncached_input_tokens': max(0, input_tokens - cached),
+        'cache_write_tokens': written
+    }
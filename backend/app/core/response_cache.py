@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, NamedTuple, Tuple
+import os
+import re
+import time
+from app.core.intent_classifier import fold_text
+
+def normalize_message(message: str) -> str:
+    """'¿Cuál es el HORARIO?' -> 'cual es el horario'"""
+    return " ".join(re.sub(r"[^\w\s]", " ", fold_text(message)).split())
+
+class CachedResponse(NamedTuple):
+    response: str
+    tokens: int
+    llm_latency_ms: float
+    expires_at: float
+
+class ResponseCache:
+    """Caché de respuestas del LLM por (sesión, hash del prompt, hash del contexto, mensaje normalizado).
+    
+    Solo coincidencia exacta tras normalizar (mayúsculas, tildes, signos), con
+    TTL + LRU global. El hash del contexto (resumen + mensajes de la ventana)
+    evita servir una respuesta calculada para otra conversación. No hay coincidencia por similitud: preguntas parecidas
+    pueden pedir cosas distintas ('tienen casas en venta' / 'no tienen casas en
+    venta', 'casa 1' / 'casa 2') y servirían una respuesta equivocada.
+    """
+    
+    def __init__(self, max_entries: int = 5000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str, str, str], CachedResponse]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.saved_latency_ms = 0.0
+    
+    def _get_entry(self, key: Tuple[str, str, str, str]) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+    
+    def get(self, session_id: str, prompt_hash: str, message: str,
+            context_hash: str = "") -> Optional[CachedResponse]:
+        entry = self._get_entry((session_id, prompt_hash, context_hash, normalize_message(message)))
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self.saved_tokens += entry.tokens
+        self.saved_latency_ms += entry.llm_latency_ms
+        return entry
+    
+    def put(self, session_id: str, prompt_hash: str, message: str, response: str,
+            tokens: int = 0, llm_latency_ms: float = 0.0, context_hash: str = ""):
+        key = (session_id, prompt_hash, context_hash, normalize_message(message))
+        self._entries[key] = CachedResponse(response, tokens, llm_latency_ms, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def invalidate_session(self, session_id: str):
+        """Descarta todas las respuestas de una sesión"""
+        for key in [k for k in self._entries if k[0] == session_id]:
+            del self._entries[key]
+    
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "saved_tokens": self.saved_tokens,
+            "saved_latency_ms": round(self.saved_latency_ms, 1)
+        }
+
+# Instancia global de la caché de respuestas
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+)
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from datetime import datetime, date
+from decimal import Decimal
+import json
+import os
+import time
+from app.core.database import db
+from app.core.logging_config import get_logger
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis es opcional: sin el paquete solo se usa la caché en memoria
+    aioredis = None
+
+logger = get_logger(__name__)
+
+def _to_cacheable(row: Dict) -> Dict[str, Any]:
+    """Convierte una fila a tipos JSON para que ambos backends devuelvan lo mismo"""
+    value = {}
+    for key, item in row.items():
+        if isinstance(item, (datetime, date)):
+            item = item.isoformat()
+        elif isinstance(item, Decimal):
+            item = float(item)
+        value[key] = item
+    return value
+
+class MemoryCacheBackend:
+    """Caché local del proceso con TTL y LRU acotado"""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    async def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return dict(value)
+    
+    async def set(self, key: str, value: Dict):
+        self._entries[key] = (time.monotonic() + self.ttl, dict(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+    
+    async def close(self):
+        self._entries.clear()
+    
+    def size(self) -> int:
+        return len(self._entries)
+
+class RedisCacheBackend:
+    """Caché compartida entre réplicas: las invalidaciones son visibles para todas"""
+    
+    def __init__(self, url: str, ttl: float, prefix: str = "callflow:session:"):
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.client = aioredis.from_url(url)
+    
+    async def get(self, key: str) -> Optional[Dict]:
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+    
+    async def set(self, key: str, value: Dict):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+    
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+    
+    async def close(self):
+        await self.client.close()
+    
+    def size(self) -> Optional[int]:
+        return None
+
+class SessionCache:
+    """Caché read-through de filas de sesión (con su agent_config).
+    
+    Los errores del backend nunca rompen la petición: se registran y se
+    consulta directamente la base de datos.
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+    
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Devuelve la sesión como dict o None si no existe"""
+        try:
+            cached = await self.backend.get(session_id)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error leyendo caché de sesiones", error=str(e))
+            cached = None
+        
+        if cached is not None:
+            self.hits += 1
+            return cached
+        
+        self.misses += 1
+        async with await db.get_connection() as conn:
+            # Sesión + agent_config: cubre todo lo que leen chat, calls, dashboard y sessions
+            row = await conn.fetchrow_prepared("session_lookup", session_id)
+        
+        if not row:
+            return None
+        
+        value = _to_cacheable(dict(row))
+        try:
+            await self.backend.set(session_id, value)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error escribiendo caché de sesiones", error=str(e))
+        
+        return value
+    
+    async def invalidate(self, session_id: str):
+        """Descarta la sesión de la caché (llamar tras borrar o modificar la sesión o su config)"""
+        try:
+            await self.backend.delete(session_id)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error invalidando caché de sesiones", session_id=session_id, error=str(e))
+    
+    async def close(self):
+        await self.backend.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors
+        }
+
+def _create_backend():
+    ttl = float(os.getenv("SESSION_CACHE_TTL", "300"))
+    backend = os.getenv("SESSION_CACHE_BACKEND", "memory")
+    
+    if backend == "redis":
+        if aioredis is None:
+            raise RuntimeError("SESSION_CACHE_BACKEND=redis requiere el paquete 'redis'")
+        return RedisCacheBackend(os.getenv("REDIS_URL", "redis://localhost:6379"), ttl)
+    
+    return MemoryCacheBackend(int(os.getenv("SESSION_CACHE_MAX_SIZE", "10000")), ttl)
+
+# Instancia global de la caché de sesiones
+session_cache = SessionCache(_create_backend())
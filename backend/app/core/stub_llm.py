@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional, AsyncIterator, Tuple
+import asyncio
+import hashlib
+import json
+import time
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+class StubChatModel(BaseChatModel):
+    """Proveedor LLM local y determinista para pruebas y benchmarks.
+    
+    Responde con un eco del último mensaje del usuario tras `latency_ms`
+    (tiempo hasta el primer token) y, en streaming, emite una palabra cada
+    `chunk_ms`. Informa usage_metadata como un proveedor real.
+    
+    Simula la caché de prefijos de Anthropic: el prefijo hasta cada bloque con
+    `cache_control` se guarda `cache_ttl_s` segundos si tiene al menos
+    `cache_min_tokens` (1024, como el proveedor). Desde la última marca se busca
+    hacia atrás, bloque a bloque, el prefijo más largo ya guardado; sus tokens
+    se informan como leídos de caché y el resto hasta la marca, como escritos
+    (`cache_read_input_tokens` / `cache_creation_input_tokens`).
+    """
+    
+    model: str = "stub"
+    latency_ms: float = 50.0
+    chunk_ms: float = 5.0
+    cache_ttl_s: float = 300.0
+    cache_min_tokens: int = 1024
+    _prefix_cache: Dict[str, float] = PrivateAttr(default_factory=dict)
+    
+    @property
+    def _llm_type(self) -> str:
+        return "callflow-stub"
+    
+    @staticmethod
+    def _reply(messages: List[BaseMessage]) -> str:
+        last = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        return f"Respuesta simulada a: {last}"
+    
+    @staticmethod
+    def _tokens(content: Any) -> int:
+        if isinstance(content, str):
+            return max(1, len(content) // 4)
+        return sum(max(1, len(block.get("text", "")) // 4) for block in content)
+    
+    @staticmethod
+    def _prefixes(messages: List[BaseMessage]) -> List[Tuple[str, int, bool]]:
+        """(hash, tokens, marcado) del prefijo que termina en cada bloque, en orden"""
+        digest = hashlib.sha256()
+        prefixes = []
+        tokens = 0
+        for message in messages:
+            blocks = message.content if isinstance(message.content, list) else [
+                {"type": "text", "text": message.content}
+            ]
+            for block in blocks:
+                digest.update(json.dumps([message.type, block.get("text", "")], ensure_ascii=False).encode("utf-8"))
+                tokens += max(1, len(block.get("text", "")) // 4)
+                prefixes.append((digest.copy().hexdigest(), tokens, "cache_control" in block))
+        return prefixes
+    
+    def _prompt_cache(self, messages: List[BaseMessage]) -> Tuple[int, int]:
+        """(tokens leídos de caché, tokens escritos en caché) para esta petición"""
+        prefixes = self._prefixes(messages)
+        marks = [index for index, (_, _, marked) in enumerate(prefixes) if marked]
+        if not marks:
+            return 0, 0
+        
+        now = time.monotonic()
+        read = next(
+            (tokens for key, tokens, _ in reversed(prefixes[:marks[-1] + 1])
+             if tokens >= self.cache_min_tokens and self._prefix_cache.get(key, 0) > now),
+            0
+        )
+        written = 0
+        for index in marks:
+            key, tokens, _ = prefixes[index]
+            if tokens < self.cache_min_tokens:
+                continue
+            # Como en Anthropic, cada lectura renueva el TTL
+            self._prefix_cache[key] = now + self.cache_ttl_s
+            written = max(written, tokens - read)
+        
+        if len(self._prefix_cache) > 10000:
+            for expired in [k for k, expires in self._prefix_cache.items() if expires <= now]:
+                del self._prefix_cache[expired]
+        return read, written
+    
+    def _usage(self, messages: List[BaseMessage], text: str) -> Tuple[dict, dict]:
+        """usage_metadata y response_metadata con el formato de Anthropic"""
+        cache_read, cache_write = self._prompt_cache(messages)
+        # input_tokens excluye lo leído y lo escrito en caché
+        input_tokens = max(0, sum(self._tokens(m.content) for m in messages) - cache_read - cache_write)
+        output_tokens = max(1, len(text) // 4)
+        usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+        response_metadata = {"model": self.model, "usage": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_write
+        }}
+        return usage_metadata, response_metadata
+    
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        text = self._reply(messages)
+        usage, metadata = self._usage(messages, text)
+        message = AIMessage(content=text, usage_metadata=usage, response_metadata=metadata)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return self._result(messages)
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._result(messages)
+    
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        text = self._reply(messages)
+        words = text.split(" ")
+        usage, metadata = self._usage(messages, text)
+        
+        for index, word in enumerate(words):
+            last = index == len(words) - 1
+            token = word if last else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=token,
+                usage_metadata=usage if last else None,
+                response_metadata=metadata if last else {}
+            ))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            if self.chunk_ms:
+                await asyncio.sleep(self.chunk_ms / 1000)
@@ -0,0 +1,210 @@
+"""Trazas por petición y spans del flujo de LangGraph.
+
+Cada petición HTTP abre una traza (TracingMiddleware) y dentro de ella se miden
+spans: construcción del grafo, cada nodo, la llamada al LLM (con tokens) y las
+consultas a la BD. El coste queda acotado así:
+
+- Los spans con nombre (`tracer.span`) alimentan siempre el histograma
+  `span_duration_seconds`, que se expone en /metrics.
+- Solo las trazas muestreadas (TRACE_SAMPLE_RATE) guardan el detalle de sus
+  spans y se emiten como un log JSON estructurado (structlog). Las lentas
+  (TRACE_SLOW_MS) se emiten siempre, con el detalle si estaban muestreadas.
+- El log pasa por el pipeline de logging_config.py: cola acotada y escritura
+  a stdout en un hilo aparte, nunca en el event loop.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+import os
+import random
+import time
+import uuid
+from app.core.logging_config import get_logger
+from app.core.metrics import Histogram, Counter
+
+TRACE_LOGGER = "callflow.trace"
+
+# Rutas que no se trazan (scrapes y health checks)
+UNTRACED_PATHS = ("/metrics", "/health")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("callflow_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("callflow_span", default=None)
+
+class Span:
+    """Span en curso; sus atributos se completan con `set` o `tracer.annotate`"""
+    __slots__ = ("name", "attrs")
+    
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+    
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class Trace:
+    """Traza de una petición: spans terminados, en orden de finalización"""
+    
+    def __init__(self, name: str, sampled: bool, max_spans: int, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.max_spans = max_spans
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped_spans = 0
+    
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+    
+    def add(self, name: str, start: float, duration: float, parent: Optional[str], attrs: Dict[str, Any]):
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return
+        self.spans.append({
+            "name": name,
+            "parent": parent,
+            "start_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            **attrs
+        })
+
+class Tracer:
+    def __init__(self, sample_rate: float = 0.1, slow_ms: float = 2000, max_spans: int = 200):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        self.span_duration = Histogram("span_duration_seconds", "Duración de los spans por nombre")
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta"
+        )
+        self.traces = Counter("traces_total", "Trazas por resultado del muestreo")
+        self.logger = get_logger(TRACE_LOGGER)
+    
+    def _sample(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+    
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Abre la traza de una petición; se emite al cerrarse si está muestreada o es lenta"""
+        trace = Trace(name, self._sample(), self.max_spans, attrs)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            self._finish(trace)
+    
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Mide un bloque: siempre en el histograma y, si la traza está muestreada, en su detalle"""
+        span = Span(name, attrs)
+        parent = _current_span.get()
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_span.reset(token)
+            self.span_duration.observe(duration, span=name)
+            trace = _current_trace.get()
+            if trace is not None and trace.sampled:
+                trace.add(name, start, duration, parent.name if parent else None, span.attrs)
+    
+    def record(self, name: str, duration: float, **attrs):
+        """Añade al detalle de la traza un span ya medido por otra métrica (p. ej. consultas a la BD)"""
+        trace = _current_trace.get()
+        if trace is None or not trace.sampled:
+            return
+        parent = _current_span.get()
+        trace.add(name, time.perf_counter() - duration, duration, parent.name if parent else None, attrs)
+    
+    def annotate(self, **attrs):
+        """Atributos para el span en curso (no hace nada fuera de un span)"""
+        span = _current_span.get()
+        if span is not None:
+            span.attrs.update(attrs)
+    
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.id if trace is not None else None
+    
+    def _finish(self, trace: Trace):
+        duration_ms = (time.perf_counter() - trace.start) * 1000
+        slow = bool(self.slow_ms) and duration_ms >= self.slow_ms
+        self.traces.inc(sampled=str(trace.sampled).lower())
+        if not trace.sampled and not slow:
+            return
+        
+        event = {
+            "trace_id": trace.id,
+            "started_at": trace.started_at,
+            "duration_ms": round(duration_ms, 2),
+            "sampled": trace.sampled,
+            "slow": slow,
+            **trace.attrs
+        }
+        if trace.sampled:
+            event["total_tokens"] = sum(s.get("total_tokens", 0) for s in trace.spans)
+            event["spans"] = trace.spans
+            if trace.dropped_spans:
+                event["dropped_spans"] = trace.dropped_spans
+        if slow:
+            self.logger.warning(trace.name, **event)
+        else:
+            self.logger.info(trace.name, **event)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "max_spans": self.max_spans
+        }
+
+class TracingMiddleware:
+    """Middleware ASGI que abre una traza por petición HTTP y devuelve su id en X-Trace-Id"""
+    
+    def __init__(self, app, tracer: Optional[Tracer] = None):
+        self.app = app
+        self.tracer = tracer
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNTRACED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        
+        active_tracer = self.tracer or tracer
+        status_code = 500
+        
+        with active_tracer.trace("http.request", method=scope["method"], path=scope["path"]) as trace:
+            async def send_with_trace_id(message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    message["headers"] = [*message.get("headers", ()), (b"x-trace-id", trace.id.encode())]
+                await send(message)
+            
+            start = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # Plantilla de la ruta (no la URL) para no disparar la cardinalidad
+                route = getattr(scope.get("route"), "path", "unmatched")
+                trace.set(route=route, status=status_code)
+                active_tracer.request_duration.observe(
+                    time.perf_counter() - start,
+                    method=scope["method"], route=route, status=str(status_code)
+                )
+
+# Instancia global del tracer
+tracer = Tracer(
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", "2000")),
+    max_spans=int(os.getenv("TRACE_MAX_SPANS", "200"))
+)
@@ -0,0 +1,150 @@
+"""Acceso a la base de datos con ámbito de petición.
+
+Los routers reciben un `UnitOfWork` (`uow = Depends(get_uow)`) en lugar del
+pool. La conexión se pide al pool solo cuando hace falta y se devuelve en
+cuanto deja de usarse, de modo que nunca queda retenida mientras la petición
+espera al LLM, a Redis o al cliente:
+
+- Las sentencias sueltas (`await uow.fetch(...)`) toman una conexión y la
+  devuelven al terminar.
+- Varias sentencias seguidas van en `async with uow.hold()` o
+  `async with uow.transaction()`. La conexión se libera al salir del bloque,
+  y los bloques anidados reutilizan la misma conexión.
+
+Dentro de un bloque se mide el mayor hueco entre operaciones de BD. Si supera
+DB_HOLD_WARN_MS (la conexión estuvo prestada esperando otra cosa), se registra
+un aviso con la ruta y la consulta previa al hueco, y se cuenta en
+`db_idle_holds_total`.
+"""
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+import os
+import time
+from starlette.requests import HTTPConnection
+from app.core.database import db, Database, _query_label
+from app.core.logging_config import get_logger
+from app.core.metrics import Counter
+from app.core.tracing import tracer
+
+logger = get_logger(__name__)
+
+DB_HOLD_WARN_MS = float(os.getenv("DB_HOLD_WARN_MS", "100"))
+
+idle_holds = Counter("db_idle_holds_total", "Bloques que retuvieron una conexión sin usarla más de DB_HOLD_WARN_MS")
+
+class UnitOfWork:
+    """Conexión perezosa de una petición (no compartir entre tareas concurrentes)"""
+    
+    def __init__(self, database: Database, label: str = "", hold_warn_ms: float = DB_HOLD_WARN_MS):
+        self.database = database
+        self.label = label
+        self.hold_warn_ms = hold_warn_ms
+        self._acquire = None
+        self._conn = None
+        self._acquired_at = 0.0
+        self._last_op_end = 0.0
+        self._last_query: Optional[str] = None
+        self._max_gap = 0.0
+        self._gap_after: Optional[str] = None
+    
+    async def _run(self, method: str, query: str, *args, **kwargs) -> Any:
+        if self._conn is None:
+            async with await self.database.get_connection() as conn:
+                return await getattr(conn, method)(query, *args, **kwargs)
+        
+        start = time.perf_counter()
+        self._note_gap(start)
+        try:
+            return await getattr(self._conn, method)(query, *args, **kwargs)
+        finally:
+            self._last_op_end = time.perf_counter()
+            self._last_query = query
+    
+    def _note_gap(self, now: float):
+        gap = now - self._last_op_end
+        if gap > self._max_gap:
+            self._max_gap = gap
+            self._gap_after = self._last_query
+    
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self._run("fetch", query, *args, **kwargs)
+    
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self._run("fetchrow", query, *args, **kwargs)
+    
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self._run("fetchval", query, *args, **kwargs)
+    
+    async def execute(self, query: str, *args, **kwargs):
+        return await self._run("execute", query, *args, **kwargs)
+    
+    async def fetch_prepared(self, name: str, *args):
+        return await self._run("fetch_prepared", name, *args)
+    
+    async def fetchrow_prepared(self, name: str, *args):
+        return await self._run("fetchrow_prepared", name, *args)
+    
+    async def fetchval_prepared(self, name: str, *args):
+        return await self._run("fetchval_prepared", name, *args)
+    
+    async def copy_records_to_table(self, table_name: str, **kwargs):
+        return await self._run("copy_records_to_table", table_name, **kwargs)
+    
+    @asynccontextmanager
+    async def hold(self):
+        """Mantiene una conexión para varias sentencias; se devuelve al pool al salir"""
+        if self._conn is not None:
+            yield self
+            return
+        
+        self._acquire = await self.database.get_connection()
+        self._conn = await self._acquire.__aenter__()
+        self._acquired_at = self._last_op_end = time.perf_counter()
+        self._last_query = self._gap_after = None
+        self._max_gap = 0.0
+        try:
+            yield self
+        finally:
+            await self._release()
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """Bloque transaccional sobre la conexión retenida"""
+        async with self.hold():
+            async with self._conn.transaction():
+                yield self
+            self._last_op_end = time.perf_counter()
+    
+    async def _release(self):
+        if self._conn is None:
+            return
+        now = time.perf_counter()
+        self._note_gap(now)
+        acquire, self._acquire, self._conn = self._acquire, None, None
+        await acquire.__aexit__(None, None, None)
+        
+        held = now - self._acquired_at
+        tracer.record("db.hold", held, idle_ms=round(self._max_gap * 1000, 2))
+        if self._max_gap * 1000 >= self.hold_warn_ms:
+            idle_holds.inc(route=self.label)
+            logger.warning(
+                "Conexión retenida sin usar durante un await ajeno a la BD",
+                route=self.label,
+                idle_ms=round(self._max_gap * 1000, 1),
+                held_ms=round(held * 1000, 1),
+                after_query=_query_label(self._gap_after) if self._gap_after else "(tras adquirir)"
+            )
+    
+    async def close(self):
+        """Devuelve la conexión si algo la dejó retenida (fin de la petición)"""
+        if self._conn is not None:
+            await self._release()
+
+async def get_uow(connection: HTTPConnection):
+    """Dependencia de FastAPI: un UnitOfWork por petición (HTTP o WebSocket)"""
+    route = getattr(connection.scope.get("route"), "path", connection.url.path)
+    uow = UnitOfWork(db, label=route)
+    try:
+        yield uow
+    finally:
+        await uow.close()
@@ -1,18 +1,77 @@
 
+import time
+# Coste de importar la app (routers, LangGraph...), se informa en el log de arranque
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
+import asyncio
+import os
 import uvicorn
-from app.core.database import init_db
+from app.core.database import init_db, db
+from app.core.stats_aggregator import stats_aggregator
+from app.core.session_cache import session_cache
+from app.core.campaigns import campaign_manager
+from app.core.event_bus import event_bus
+from app.core.message_archive import message_archive
+from app.core.session_purger import session_purger
+from app.core.llm_gateway import llm_gateway
+from app.core.agent_registry import agent_registry
+from app.core.intent_classifier import intent_classifier
+from app.core.import_report import lazy_imports
+from app.core.metrics import registry
+from app.core.tracing import TracingMiddleware
+from app.core.logging_config import configure_logging, shutdown_logging, get_logger
 from app.api import sessions, chat, dashboard, calls
 
+APP_IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
+
+# Precargar en el arranque el grafo, los SDK de los proveedores configurados y spaCy
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "false").lower() in ("1", "true", "yes")
+
+logger = get_logger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    await init_db()
+    startup_started = time.perf_counter()
+    configure_logging()
+    warmup = None
+    if STARTUP_WARMUP:
+        # Las importaciones del warm-up corren en un hilo mientras se abre el pool
+        _, warmup = await asyncio.gather(init_db(), asyncio.to_thread(agent_registry.warm_up))
+    elif intent_classifier.use_spacy:
+        # Con spaCy activo el modelo se carga siempre aquí, no en la primera petición
+        _, spacy_loaded = await asyncio.gather(init_db(), asyncio.to_thread(intent_classifier.warm_up))
+        warmup = {"spacy": spacy_loaded}
+    else:
+        await init_db()
+    stats_aggregator.start()
+    await event_bus.start()
+    message_archive.start()
+    session_purger.start()
+    logger.info(
+        "Arranque completado",
+        app_import_ms=APP_IMPORT_MS,
+        startup_ms=round((time.perf_counter() - startup_started) * 1000, 1),
+        warmup=warmup,
+        lazy_imports=lazy_imports()
+    )
     yield
-    # Shutdown
-    pass
+    # Shutdown: uvicorn ya esperó a las peticiones en curso; quedan las llamadas al LLM
+    # en segundo plano (p. ej. resúmenes de conversación)
+    if not await llm_gateway.drain(float(os.getenv("LLM_DRAIN_TIMEOUT", "20"))):
+        logger.warning("Apagado con llamadas al LLM sin terminar", in_flight=llm_gateway.in_flight)
+    # Interrumpir campañas (guarda sus resultados) y volcar los contadores pendientes
+    await campaign_manager.stop()
+    await message_archive.stop()
+    await session_purger.stop()
+    await stats_aggregator.stop()
+    await event_bus.stop()
+    await session_cache.close()
+    shutdown_logging()
 
 app = FastAPI(
     title="CallFlow AI Backend",
@@ -28,8 +87,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Prev-Cursor", "X-Next-Cursor", "X-Trace-Id"],
 )
 
+# Traza por petición (spans de nodos, LLM y BD); el muestreo se ajusta con TRACE_SAMPLE_RATE
+app.add_middleware(TracingMiddleware)
+
 # Incluir routers de API
 app.include_router(sessions.router, prefix="/api/sessions", tags=["sessions"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
@@ -44,5 +107,16 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "Backend funcionando correctamente"}
 
+@app.get("/metrics/db")
+async def database_metrics():
+    """Conexiones en uso/libres, espera de adquisición y latencia por consulta"""
+    return db.metrics()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Histogramas, contadores y gauges del proceso en formato de texto de Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Solo desarrollo (recarga automática); en producción: python -m app.server
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -17,7 +17,7 @@ class Plan(str, Enum):
 
 class SessionCreate(BaseModel):
     business_name: str = Field(..., min_length=1, max_length=200)
-    website: Optional[str] = None
+    website: Optional[str] = Field(None, max_length=500)
     location: str = Field(..., min_length=1, max_length=100)
     property_types: str = Field(..., min_length=1, max_length=200)
     working_hours: str = Field(..., min_length=1, max_length=100)
@@ -53,6 +53,11 @@ class CallSimulation(BaseModel):
     session_id: str
     phone_number: str
 
+class CampaignCreate(BaseModel):
+    session_id: str
+    phone_numbers: List[str] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1)
+
 class DashboardStats(BaseModel):
     session_id: str
     total_calls: int
@@ -62,6 +67,21 @@ class DashboardStats(BaseModel):
     messages_count: int
     last_activity: Optional[datetime]
 
+class DashboardBatchRequest(BaseModel):
+    session_ids: List[str] = Field(..., min_length=1, max_length=500)
+
+class DashboardBatchResponse(BaseModel):
+    stats: List[DashboardStats]
+    missing: List[str]
+
+class HourlyStats(BaseModel):
+    bucket: datetime
+    total_calls: int
+    total_minutes: int
+    leads: int
+    scheduled_visits: int
+    messages_count: int
+
 class AgentConfig(BaseModel):
     session_id: str
     system_prompt: str
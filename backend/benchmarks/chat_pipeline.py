@@ -0,0 +1,360 @@
+"""Benchmark de carga del backend con un LLM simulado.
+
+Levanta la aplicación FastAPI en el mismo proceso (httpx + ASGI, con su
+lifespan) contra el PostgreSQL de DATABASE_URL y el proveedor `stub` en lugar
+de ChatOpenAI/ChatAnthropic. Lanza peticiones a /api/chat/, /api/sessions/,
+/api/dashboard/ y /api/calls/simulate con la concurrencia indicada e informa
+throughput, latencias p50/p95/p99 por escenario y el desglose por etapa
+(espera de pool, consultas a la base de datos, grafo de LangGraph y LLM).
+
+Uso (desde backend/):
+    python -m benchmarks.chat_pipeline --concurrency 20 --duration 30 --llm-latency-ms 200 \\
+        --output resultados.json
+    python -m benchmarks.chat_pipeline --compare resultados.json   # compara con una ejecución previa
+
+Con --url se mide un servidor ya arrancado (p. ej. uvicorn con varios workers);
+en ese modo no hay tiempo de grafo y el resto de etapas son las del worker que
+responda a /metrics/db y /api/chat/llm/stats.
+"""
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+SAMPLE_MESSAGES = [
+    "¿Cuáles son sus horarios de atención?",
+    "¿Dónde están ubicados?",
+    "¿Qué tipos de propiedades manejan?",
+    "Busco un departamento de dos recámaras cerca del centro",
+    "¿Tienen casas con jardín?",
+    "Me llamo Ana y mi teléfono es 555 123 4567",
+    "Quiero agendar una visita para el sábado",
+    "¿Puedo ver la propiedad esta semana?"
+]
+
+SCENARIOS = ("chat", "dashboard", "sessions", "simulate")
+
+def _parse_mix(mix: str) -> Dict[str, float]:
+    """'chat=70,dashboard=20' -> pesos por escenario"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Escenario desconocido: {name} (disponibles: {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+def _configure_environment(args):
+    """Debe ejecutarse antes de importar la aplicación: la configuración se lee al importar"""
+    os.environ["LLM_PROVIDER_OVERRIDE"] = "stub"
+    os.environ["STUB_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["STUB_LLM_CHUNK_MS"] = "0"
+    os.environ["CALL_SIMULATION_SECONDS"] = str(args.call_latency_ms / 1000)
+    os.environ.setdefault("DB_AUTO_MIGRATE", "true")
+    if not args.response_cache:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+def _summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0
+    }
+
+def _histogram_delta(before: List[Dict], after: List[Dict], group_by: Optional[str] = None) -> Dict[str, Dict]:
+    """Diferencia entre dos snapshots de Histogram (solo lo ocurrido durante la medición)"""
+    def index(snapshot):
+        return {json.dumps(series["labels"], sort_keys=True): series for series in snapshot}
+    
+    previous = index(before)
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for key, series in index(after).items():
+        base = previous.get(key, {"sum": 0.0, "count": 0, "buckets": {}})
+        count = series["count"] - base["count"]
+        if count <= 0:
+            continue
+        
+        name = series["labels"].get(group_by, "all") if group_by else "all"
+        entry = grouped.setdefault(name, {"count": 0, "sum": 0.0, "buckets": {}})
+        entry["count"] += count
+        entry["sum"] += series["sum"] - base["sum"]
+        for bound, cumulative in series["buckets"].items():
+            entry["buckets"][bound] = entry["buckets"].get(bound, 0) + cumulative - base["buckets"].get(bound, 0)
+    
+    result = {}
+    for name, entry in grouped.items():
+        # p95 aproximado: límite superior del bucket que lo contiene
+        target = 0.95 * entry["count"]
+        p95 = next((bound for bound, cumulative in entry["buckets"].items() if cumulative >= target), "+Inf")
+        result[name] = {
+            "count": entry["count"],
+            "total_ms": round(entry["sum"] * 1000, 2),
+            "mean_ms": round(entry["sum"] / entry["count"] * 1000, 3),
+            "p95_bucket_ms": p95 if p95 == "+Inf" else round(float(p95) * 1000, 2)
+        }
+    return result
+
+class Benchmark:
+    """Clientes concurrentes en bucle cerrado que eligen escenario según los pesos"""
+    
+    def __init__(self, client, args, weights: Dict[str, float]):
+        self.client = client
+        self.args = args
+        self.scenarios = list(weights)
+        self.weights = [weights[name] for name in self.scenarios]
+        self.session_ids: List[str] = []
+        self.latencies: Dict[str, List[float]] = {name: [] for name in self.scenarios}
+        self.errors: Dict[str, int] = {name: 0 for name in self.scenarios}
+        self.error_samples: List[str] = []
+        self.recording = False
+        self._counter = 0
+    
+    async def _create_session(self) -> str:
+        self._counter += 1
+        response = await self.client.post("/api/sessions/", json={
+            "business_name": f"Inmobiliaria Benchmark {self._counter}",
+            "location": "Ciudad de México",
+            "property_types": "Casas y departamentos",
+            "working_hours": "Lunes a viernes 9:00-18:00",
+            "phone": "5550000000",
+            "website": "https://example.com"
+        })
+        response.raise_for_status()
+        return response.json()["session_id"]
+    
+    async def setup(self):
+        self.session_ids = [await self._create_session() for _ in range(self.args.sessions)]
+    
+    async def _request(self, scenario: str):
+        session_id = random.choice(self.session_ids)
+        if scenario == "chat":
+            self._counter += 1
+            message = random.choice(SAMPLE_MESSAGES)
+            if not self.args.response_cache:
+                message = f"{message} ({self._counter})"
+            return await self.client.post("/api/chat/", json={"session_id": session_id, "message": message})
+        if scenario == "dashboard":
+            return await self.client.get(f"/api/dashboard/{session_id}")
+        if scenario == "simulate":
+            return await self.client.post("/api/calls/simulate",
+                                          json={"session_id": session_id, "phone_number": "5551234567"})
+        self._counter += 1
+        return await self.client.post("/api/sessions/", json={
+            "business_name": f"Inmobiliaria Benchmark {self._counter}",
+            "location": "Guadalajara",
+            "property_types": "Oficinas",
+            "working_hours": "9:00-18:00",
+            "phone": "5550000001"
+        })
+    
+    async def _worker(self, deadline: float):
+        while time.monotonic() < deadline:
+            scenario = random.choices(self.scenarios, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await self._request(scenario)
+                ok = response.status_code < 400
+                detail = f"{scenario}: HTTP {response.status_code} {response.text[:200]}"
+            except Exception as e:
+                ok = False
+                detail = f"{scenario}: {type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - start
+            
+            if not self.recording:
+                continue
+            if ok:
+                self.latencies[scenario].append(elapsed)
+            else:
+                self.errors[scenario] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(detail)
+    
+    async def _snapshot(self) -> Dict[str, Any]:
+        db_metrics = (await self.client.get("/metrics/db")).json()
+        llm_stats = (await self.client.get("/api/chat/llm/stats")).json()
+        return {
+            "acquire": db_metrics.get("acquire_wait_seconds", []),
+            "queries": db_metrics.get("query_duration_seconds", []),
+            "llm": llm_stats.get("latency_seconds", [])
+        }
+    
+    async def run(self, graph_timings: Optional[List[float]]) -> Dict[str, Any]:
+        concurrency = self.args.concurrency
+        
+        # Calentamiento: conexiones, sentencias preparadas, agentes y cachés
+        self.recording = False
+        warmup_deadline = time.monotonic() + self.args.warmup
+        await asyncio.gather(*[self._worker(warmup_deadline) for _ in range(concurrency)])
+        
+        if graph_timings is not None:
+            graph_timings.clear()
+        before = await self._snapshot()
+        
+        self.recording = True
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.args.duration
+        await asyncio.gather(*[self._worker(deadline) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        self.recording = False
+        
+        after = await self._snapshot()
+        
+        all_latencies = [lat for values in self.latencies.values() for lat in values]
+        stages = {
+            "db_pool_acquire": _histogram_delta(before["acquire"], after["acquire"]).get("all"),
+            "llm": _histogram_delta(before["llm"], after["llm"]).get("all")
+        }
+        if graph_timings is not None and graph_timings:
+            ordered = sorted(graph_timings)
+            stages["graph"] = {
+                "count": len(ordered),
+                "total_ms": round(sum(ordered) * 1000, 2),
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2)
+            }
+        
+        queries = _histogram_delta(before["queries"], after["queries"], group_by="query")
+        top_queries = dict(sorted(queries.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:10])
+        
+        return {
+            "totals": _summarize(all_latencies, sum(self.errors.values()), elapsed),
+            "scenarios": {
+                name: _summarize(self.latencies[name], self.errors[name], elapsed) for name in self.scenarios
+            },
+            "stages": stages,
+            "db_queries": top_queries,
+            "error_samples": self.error_samples,
+            "duration_s": round(elapsed, 2)
+        }
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def _instrument_graph(timings: List[float]):
+    """Mide CallFlowAgent.process_message (grafo completo, LLM incluido) dentro del proceso"""
+    from app.core.langraph_agent import CallFlowAgent
+    original = CallFlowAgent.process_message
+    
+    async def timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(self, *args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+    
+    CallFlowAgent.process_message = timed
+
+async def _run(args) -> Dict[str, Any]:
+    import httpx
+    
+    weights = _parse_mix(args.mix)
+    graph_timings: Optional[List[float]] = None
+    
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            benchmark = Benchmark(client, args, weights)
+            await benchmark.setup()
+            return await benchmark.run(graph_timings)
+    
+    _configure_environment(args)
+    from app.main import app
+    
+    graph_timings = []
+    _instrument_graph(graph_timings)
+    
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark",
+                                     timeout=args.timeout) as client:
+            benchmark = Benchmark(client, args, weights)
+            await benchmark.setup()
+            return await benchmark.run(graph_timings)
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Imprime las diferencias por escenario; True si alguna métrica empeora más que `threshold` %"""
+    regressed = False
+    print(f"\nComparación con {baseline.get('meta', {}).get('git_commit') or 'la ejecución base'}:")
+    for name, metrics in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in (("throughput_rps", False), ("p95_ms", True), ("p99_ms", True)):
+            old, new = base.get(metric) or 0, metrics.get(metric) or 0
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            worse = change > threshold if higher_is_worse else change < -threshold
+            regressed = regressed or worse
+            flag = "  <-- regresión" if worse else ""
+            print(f"  {name:10} {metric:15} {old:>10} -> {new:>10} ({change:+.1f}%){flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del backend de CallFlow AI con LLM simulado")
+    parser.add_argument("--concurrency", type=int, default=10, help="Clientes concurrentes")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de medición")
+    parser.add_argument("--warmup", type=float, default=5, help="Segundos de calentamiento (no se miden)")
+    parser.add_argument("--sessions", type=int, default=20, help="Sesiones creadas antes de medir")
+    parser.add_argument("--mix", default="chat=70,dashboard=20,sessions=5,simulate=5",
+                        help="Pesos por escenario: chat, dashboard, sessions, simulate")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Latencia del LLM simulado")
+    parser.add_argument("--call-latency-ms", type=float, default=50, help="Duración de /api/calls/simulate")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Permitir aciertos de la caché de respuestas (por defecto cada mensaje es único)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--url", help="Medir un servidor ya arrancado en lugar de la app en proceso")
+    parser.add_argument("--output", help="Guardar el resultado en JSON")
+    parser.add_argument("--compare", help="JSON de una ejecución previa para comparar")
+    parser.add_argument("--threshold", type=float, default=10, help="%% de empeoramiento considerado regresión")
+    args = parser.parse_args()
+    
+    result = asyncio.run(_run(args))
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "mode": "url" if args.url else "in-process",
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        **result
+    }
+    
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if _compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()